@@ -0,0 +1,200 @@
+import contextlib
+import fnmatch
+import io
+import os
+import shutil
+import sys
+import weakref
+
+from data_index import load_index
+from extractIndexNum import open_data
+
+# kt_codec (the KT-gz block format, shared with the other tools) is in the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kt_codec import KtGzFile
+
+DEFAULT_FILELIST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filelist.csv')
+
+
+class ArchiveEntryFile(io.RawIOBase):
+    """Read-only, seekable file over one uncompressed DATA1 entry (compressed ones are opened as a KtGzFile)."""
+
+    def __init__(self, data, entry):
+        offset, uncompressed_size, compressed_size, compressed = entry
+        self._data = data[offset:offset + compressed_size]
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._data)
+        if offset < 0:
+            raise ValueError(f'Negative seek position {offset}')
+        self._pos = offset
+        return self._pos
+
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        size = min(len(buffer), max(0, len(self._data) - self._pos))
+        buffer[:size] = self._data[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def close(self):
+        # Drop the view into DATA1, so the archive itself can be closed afterwards
+        self._data = None
+        super().close()
+
+
+class ArchiveFS:
+    """
+    Read-only view of a DATA0.bin/DATA1.bin pair, so files can be read straight from the archive
+    instead of extracting all of them first. Files are found by index, 'Filepath/Filename' path or
+    (unique) filename, the same as in data_index.py.
+
+        with ArchiveFS('path/to/romfs') as fs:
+            with fs.open('IN_EventBaseInfo.bin') as f:
+                header = f.read(0x20)
+
+    The names come from filelist (the filelist.csv in the directory by default, if there is one). Pass
+    filelist=False for DLC archives, which have their own index numbers the base game names don't apply to.
+    """
+
+    def __init__(self, directory='.', filelist=None):
+        data0_path = os.path.join(directory, 'DATA0.bin')
+        if filelist is None:
+            filelist = os.path.join(directory, 'filelist.csv')
+            if not os.path.exists(filelist):
+                filelist = None
+        self.index = load_index(data0_path, filelist or None)
+        self._stack = contextlib.ExitStack()
+        self._data = self._stack.enter_context(open_data(os.path.join(directory, 'DATA1.bin')))
+        # The files given out by open() read from views into the mapped DATA1, they're closed along with it
+        self._files = weakref.WeakSet()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for f in list(self._files):
+            f.close()
+        self._files.clear()
+        self._data = None
+        try:
+            self._stack.close()
+        except BufferError:
+            # Some other view into DATA1 is still around, the mapping is freed once that one is gone
+            pass
+
+    def exists(self, key):
+        try:
+            return self.index.entry(self.index.find(key))[2] != 0
+        except KeyError:
+            return False
+
+    def size(self, key):
+        file_index = self.index.find(key)
+        offset, uncompressed_size, compressed_size, compressed = self.index.entry(file_index)
+        return uncompressed_size if compressed else compressed_size
+
+    def is_compressed(self, key):
+        return self.index.entry(self.index.find(key))[3]
+
+    def indices(self):
+        """Returns the indices of every non-empty entry."""
+        compressed_sizes = self.index.compressed_sizes
+        return [file_index for file_index in range(len(compressed_sizes)) if compressed_sizes[file_index] != 0]
+
+    def stored(self, key):
+        """Returns a view of an entry as it is stored in DATA1 (KT-gz data if it's compressed), release it when done."""
+        offset, uncompressed_size, compressed_size, compressed = self.index.entry(self.index.find(key))
+        return self._data[offset:offset + compressed_size]
+
+    def glob(self, pattern):
+        """Returns the (index, path) of every non-empty entry whose path (or index) matches the pattern."""
+        pattern = pattern.replace('\\', '/')
+        return [(file_index, self.index.name(file_index)) for file_index in range(len(self.index))
+                if self.index.entry(file_index)[2] != 0
+                and fnmatch.fnmatchcase(self.index.name(file_index) or str(file_index), pattern)]
+
+    def open(self, key, buffering=io.DEFAULT_BUFFER_SIZE):
+        """Opens an entry for reading (binary only). Pass buffering=0 to get the unbuffered raw file."""
+        file_index = self.index.find(key)
+        entry = self.index.entry(file_index)
+        if entry[2] == 0:
+            raise FileNotFoundError(f'Entry {file_index} is empty in this archive')
+        offset, uncompressed_size, compressed_size, compressed = entry
+        if compressed:
+            # Only the blocks that are read get inflated
+            raw = KtGzFile(self._data[offset:offset + compressed_size])
+        else:
+            raw = ArchiveEntryFile(self._data, entry)
+        self._files.add(raw)
+        if buffering == 0:
+            return raw
+        return io.BufferedReader(raw, buffering)
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Read files straight from DATA0.bin/DATA1.bin without extracting everything.")
+    parser.add_argument("-d", "--directory", default=".", help="Directory with DATA0.bin and DATA1.bin (default: current directory)")
+    parser.add_argument("--filelist", help="filelist.csv used for the file paths (default: the one in --directory, else the one next to this script)")
+    parser.add_argument("--no-filelist", action="store_true", help="Don't use filelist.csv, files only have their index (use this for DLC archives)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ls_parser = subparsers.add_parser("ls", help="List the files matching a glob")
+    ls_parser.add_argument("pattern", nargs="?", default="*", help="Glob over the 'Filepath/Filename' paths (default: *)")
+    get_parser = subparsers.add_parser("get", help="Copy a file out of the archive")
+    get_parser.add_argument("key", help="Index, 'Filepath/Filename' or filename")
+    get_parser.add_argument("-o", "--output", help="Output file path (default: the filename, '-' for stdout)")
+    args = parser.parse_args(argv[1:])
+
+    filelist = args.filelist
+    if args.no_filelist:
+        filelist = False
+    elif filelist is None and not os.path.exists(os.path.join(args.directory, 'filelist.csv')):
+        filelist = DEFAULT_FILELIST
+        print(f'Using the base game names from {filelist} (pass --no-filelist for DLC archives)', file=sys.stderr)
+
+    try:
+        with ArchiveFS(args.directory, filelist) as fs:
+            if args.command == "ls":
+                for file_index, name in fs.glob(args.pattern):
+                    print(f'{file_index}\t{fs.size(file_index)}\t{name or ""}')
+            else:
+                file_index = fs.index.find(args.key)
+                output = args.output or (fs.index.name(file_index) or f'{file_index}.bin').rpartition('/')[2]
+                with fs.open(file_index) as f:
+                    if output == '-':
+                        shutil.copyfileobj(f, sys.stdout.buffer)
+                    else:
+                        with open(output, 'wb') as out_f:
+                            shutil.copyfileobj(f, out_f)
+                        print(f'Saved {file_index} to {output}')
+    except Exception as ex:
+        print(f'An error occurred ({type(ex).__name__}): {ex}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,205 @@
+import array
+import hashlib
+import os
+import struct
+import sys
+
+# magic, DATA0 mtime_ns, DATA0 size, DATA0 sha1, filelist mtime_ns, filelist size, entry count
+INDEX_HEADER_STRUCT = struct.Struct('<8sQQ20sQQI')
+INDEX_MAGIC = b'FE3HIDX1'
+INDEX_EXTENSION = '.idx'
+DATA0_ENTRY_STRUCT = struct.Struct('<QQQ?7x')
+
+
+class DataIndex:
+    """DATA0.bin entries joined with the filelist.csv names, looked up by index or by path."""
+
+    def __init__(self, offsets, uncompressed_sizes, compressed_sizes, compressed_flags, names):
+        self.offsets = offsets
+        self.uncompressed_sizes = uncompressed_sizes
+        self.compressed_sizes = compressed_sizes
+        self.compressed_flags = compressed_flags
+        self.names = names
+        self.by_path = {}
+        self.by_filename = {}
+        for index, name in enumerate(names):
+            if not name:
+                continue
+            self.by_path[name] = index
+            # "6163 - IN_EventBaseInfo.bin" is also reachable as just "IN_EventBaseInfo.bin", if that's unique
+            filename = name.rpartition('/')[2]
+            self.by_filename.setdefault(filename, []).append(index)
+            short_name = filename.partition(' - ')[2]
+            if short_name:
+                self.by_filename.setdefault(short_name, []).append(index)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def entry(self, index):
+        """Returns the (offset, uncompressed_size, compressed_size, compressed) record of an index."""
+        return (self.offsets[index], self.uncompressed_sizes[index],
+                self.compressed_sizes[index], bool(self.compressed_flags[index]))
+
+    def entries(self):
+        return [self.entry(index) for index in range(len(self))]
+
+    def name(self, index):
+        """Returns the 'Filepath/Filename' of an index, or None if it's not in filelist.csv."""
+        return self.names[index] or None
+
+    def find(self, key):
+        """Resolves an index, a 'Filepath/Filename' path or a (unique) filename to an index."""
+        if isinstance(key, int) or key.isdigit():
+            index = int(key)
+            if not 0 <= index < len(self):
+                raise KeyError(f'Index {index} is out of range (0-{len(self) - 1})')
+            return index
+        key = key.replace('\\', '/')
+        if key in self.by_path:
+            return self.by_path[key]
+        candidates = self.by_filename.get(key, [])
+        if len(candidates) == 1:
+            return candidates[0]
+        if candidates:
+            raise KeyError(f'{key} is ambiguous, it matches: ' + ', '.join(self.names[index] for index in candidates))
+        raise KeyError(f'{key} is not in the file list')
+
+
+def read_data0(data0_bytes):
+    offsets = array.array('Q')
+    uncompressed_sizes = array.array('Q')
+    compressed_sizes = array.array('Q')
+    compressed_flags = array.array('B')
+    for offset, uncompressed_size, compressed_size, compressed in DATA0_ENTRY_STRUCT.iter_unpack(
+            data0_bytes[:len(data0_bytes) - len(data0_bytes) % DATA0_ENTRY_STRUCT.size]):
+        offsets.append(offset)
+        uncompressed_sizes.append(uncompressed_size)
+        compressed_sizes.append(compressed_size)
+        compressed_flags.append(compressed)
+    return offsets, uncompressed_sizes, compressed_sizes, compressed_flags
+
+
+def read_names(filelist_path, count):
+    import csv
+
+    names = [''] * count
+    with open(filelist_path, 'r', newline='', encoding='utf-8') as filelist:
+        reader = csv.reader(filelist, delimiter=',')
+        header = next(reader)
+        for row in reader:
+            index = int(row[0])
+            if index < count:
+                names[index] = '%s/%s' % (row[2], row[1])
+    return names
+
+
+def file_stamp(path):
+    if path is None or not os.path.exists(path):
+        return 0, 0
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def save_index(index, cache_path, data0_stamp, data0_hash, filelist_stamp):
+    names = '\n'.join(index.names).encode('utf-8')
+    with open(cache_path, 'wb') as f:
+        f.write(INDEX_HEADER_STRUCT.pack(INDEX_MAGIC, *data0_stamp, data0_hash, *filelist_stamp, len(index)))
+        for values in (index.offsets, index.uncompressed_sizes, index.compressed_sizes, index.compressed_flags):
+            values.tofile(f)
+        f.write(names)
+
+
+def read_cache(cache_path):
+    """Returns the cache header fields and its DataIndex, or None if it's missing or unreadable."""
+    try:
+        with open(cache_path, 'rb') as f:
+            header = f.read(INDEX_HEADER_STRUCT.size)
+            magic, *stamps, count = INDEX_HEADER_STRUCT.unpack(header)
+            if magic != INDEX_MAGIC:
+                return None
+            columns = []
+            for typecode in 'QQQB':
+                values = array.array(typecode)
+                values.fromfile(f, count)
+                columns.append(values)
+            names = f.read().decode('utf-8').split('\n')
+    except (OSError, EOFError, struct.error, UnicodeDecodeError):
+        return None
+    if len(names) != count:
+        return None
+    return stamps, DataIndex(*columns, names)
+
+
+def load_index(data0_path='DATA0.bin', filelist_path='filelist.csv', cache_path=None):
+    """
+    Loads the DATA0 index from its cache file (DATA0.bin.idx by default), and only rebuilds it when
+    DATA0.bin (checked by mtime, then by hash) or filelist.csv changed since it was written.
+    Pass filelist_path=None for DLC archives, where the filelist.csv names don't apply.
+    """
+    cache_path = cache_path or data0_path + INDEX_EXTENSION
+    data0_stamp = file_stamp(data0_path)
+    filelist_stamp = file_stamp(filelist_path)
+
+    data0_bytes = None
+    data0_hash = None
+    cached = read_cache(cache_path)
+    if cached:
+        (mtime_ns, size, cached_hash, *cached_filelist_stamp), index = cached
+        if tuple(cached_filelist_stamp) == filelist_stamp and size == data0_stamp[1]:
+            if mtime_ns == data0_stamp[0]:
+                return index
+            # Only touched (e.g. copied over again), not changed: refresh the stamp and keep it
+            with open(data0_path, 'rb') as f:
+                data0_bytes = f.read()
+            data0_hash = hashlib.sha1(data0_bytes).digest()
+            if data0_hash == cached_hash:
+                save_index(index, cache_path, data0_stamp, data0_hash, filelist_stamp)
+                return index
+
+    if data0_bytes is None:
+        with open(data0_path, 'rb') as f:
+            data0_bytes = f.read()
+        data0_hash = hashlib.sha1(data0_bytes).digest()
+    columns = read_data0(data0_bytes)
+    names = read_names(filelist_path, len(columns[0])) if filelist_stamp != (0, 0) else [''] * len(columns[0])
+    index = DataIndex(*columns, names)
+    try:
+        save_index(index, cache_path, data0_stamp, data0_hash, filelist_stamp)
+    except OSError as ex:
+        print(f'Warning: could not write the index cache {cache_path} ({ex})')
+    return index
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Look up where files are stored in DATA1.bin (by index, path or filename).")
+    parser.add_argument("keys", nargs="+", help="Index, 'Filepath/Filename' or filename (e.g. IN_EventBaseInfo.bin)")
+    parser.add_argument("--data0", default="DATA0.bin", help="Path to DATA0.bin (default: DATA0.bin)")
+    parser.add_argument("--filelist", default="filelist.csv", help="Path to filelist.csv (default: filelist.csv)")
+    parser.add_argument("--no-filelist", action="store_true", help="Don't use filelist.csv (for DLC archives)")
+    args = parser.parse_args(argv[1:])
+
+    try:
+        index = load_index(args.data0, None if args.no_filelist else args.filelist)
+    except Exception as ex:
+        print(f'An error occurred ({type(ex).__name__}): {ex}')
+        return 1
+
+    result = 0
+    for key in args.keys:
+        try:
+            file_index = index.find(key)
+        except KeyError as ex:
+            print(ex.args[0])
+            result = 1
+            continue
+        offset, uncompressed_size, compressed_size, compressed = index.entry(file_index)
+        print(f'{file_index}: {index.name(file_index) or "(unknown)"}')
+        print(f'  DATA1 offset: 0x{offset:X}, size: {compressed_size}, uncompressed size: {uncompressed_size}, compressed: {compressed}')
+    return result
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
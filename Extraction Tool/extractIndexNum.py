@@ -1,76 +1,626 @@
 import sys
-import struct
 import os
-import zlib
-from struct import unpack as up, pack as pk
-
-def iterate(s, ofs, num_entries, entry_size):
-    return [s[ofs + entry_size * i:ofs + entry_size * (i + 1)] for i in range(num_entries)]
-
-def uncompress(data):
-    def align(ofs):
-        return (ofs + 0x7F) & ~0x7F
-    split_size, num_entries, total_size = up('<III', data[:0xC])
-    splits = [up('<I', entry)[0] for entry in iterate(data, 0xC, num_entries, 4)]
-    ofs = align(0xC + 0x4 * num_entries)
-    out_data = b''
-    for split in splits:
-        cur_comp = up('<I', data[ofs:ofs+4])[0]
-        assert cur_comp == split - 4
-        out_data += zlib.decompress(data[ofs+4:ofs+4+cur_comp])
-        ofs = align(ofs + split)
-    assert len(out_data) == total_size
-    return out_data
-
-def uncompress_to_file(f, data):
-    def align(ofs):
-        return (ofs + 0x7F) & ~0x7F
-    split_size, num_entries, total_size = up('<III', data[:0xC])
-    splits = [up('<I', entry)[0] for entry in iterate(data, 0xC, num_entries, 4)]
-    ofs = align(0xC + 0x4 * num_entries)
-    for i, split in enumerate(splits):
-        cur_comp = up('<I', data[ofs:ofs+4])[0]
-        if i == num_entries - 1:
-            if cur_comp != split - 4:
-                assert split + (split_size * (num_entries - 1)) == total_size
-                f.write(data[ofs:ofs+split])
-            else:
-                f.write(zlib.decompress(data[ofs+4:ofs+4+cur_comp]))
-        else:
-            assert cur_comp == split - 4
-            f.write(zlib.decompress(data[ofs+4:ofs+4+cur_comp]))
-        ofs = align(ofs + split)
-
-def extract(meta, data):
-    fileIndex = -1
-    meta_data = meta.read()
-    entries = [up('<QQQ?', entry[:0x19]) for entry in iterate(meta_data, 0, len(meta_data) // 0x20, 0x20)]
-    os.makedirs("out", exist_ok=True)
-    for (offset, uncompressed_size, compressed_size, compressed) in entries:
-        fileIndex += 1
-        if compressed_size == 0:
+import argparse
+import hashlib
+import json
+import fnmatch
+import functools
+import contextlib
+import mmap
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+import traceback
+import shutil
+import stat
+from data_index import load_index
+
+# kt_codec (the KT-gz block format, shared with the other tools) is in the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kt_codec import KtGzError, TailStats, format_tail_stats, inspect_tail, iter_kt_gz_buffer, parse_kt_gz_header
+
+def clear_tracebacks(ex):
+    """Clears the frames of the tracebacks of ex and of every exception chained to it."""
+    pending = [ex]
+    seen = set()
+    while pending:
+        ex = pending.pop()
+        if ex is None or id(ex) in seen:
             continue
-        print(f'Saving data from {fileIndex}')
-        data.seek(offset)
-        cur_data = data.read(compressed_size)
-        with open(f'out/{fileIndex}.bin', 'wb') as f:
-            if compressed:
-                uncompress_to_file(f, cur_data)
-            else:
-                f.write(cur_data)
+        seen.add(id(ex))
+        traceback.clear_frames(ex.__traceback__)
+        pending += [ex.__cause__, ex.__context__]
+
+@contextlib.contextmanager
+def open_data(path):
+    # DATA1 is mapped instead of read, slicing the memoryview gives zero-copy views
+    # of each block that the codec and write() can consume directly
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            yield view
+        except BaseException as ex:
+            # The tracebacks (the chained ones too) still reference block views and the generators
+            # holding them, which would keep the map from closing
+            clear_tracebacks(ex)
+            view.release()
+            # Should a view still be around, the mapping goes away with it, the error is what matters
+            with contextlib.suppress(BufferError):
+                mapped.close()
+            raise
+        view.release()
+        mapped.close()
+
+def parse_range(text):
+    first, _, last = text.partition('-')
+    return int(first), int(last or first)
+
+class Selection:
+    """Which entries to extract: index ranges and/or globs over the filelist.csv paths."""
+    def __init__(self, ranges=(), patterns=()):
+        self.ranges = list(ranges)
+        self.patterns = list(patterns)
+
+    def add(self, item):
+        # Anything that looks like "123" or "6341-7437" is an index range, everything else a path glob
+        item = item.strip()
+        if not item or item.startswith('#'):
+            return
+        try:
+            self.ranges.append(parse_range(item))
+        except ValueError:
+            self.patterns.append(item.replace('\\', '/'))
+
+    def add_list_file(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self.add(line)
+
+    def __bool__(self):
+        return bool(self.ranges or self.patterns)
+
+    def __contains__(self, item):
+        fileIndex, name = item
+        if any(first <= fileIndex <= last for first, last in self.ranges):
+            return True
+        return name is not None and any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns)
+
+def plan(entries, names=None, selection=None):
+    """Returns the (fileIndex, entry, out_path) jobs of the entries to extract."""
+    jobs = []
+    for fileIndex, entry in enumerate(entries):
+        if entry[2] == 0:
+            continue
+        name = names[fileIndex] if names else None
+        if selection and (fileIndex, name) not in selection:
+            continue
+        jobs.append((fileIndex, entry, f'out/{name}' if name else f'out/{fileIndex}.bin'))
+    return jobs
+
+def make_dirs(jobs):
+    for directory in {os.path.dirname(out_path) for _, _, out_path in jobs}:
+        os.makedirs(directory, exist_ok=True)
+
+class HashingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha1()
+
+    def write(self, b):
+        self.hash.update(b)
+        return self.f.write(b)
+
+class TimingWriter:
+    def __init__(self, f):
+        self.f = f
+        self.time = 0.0
+        self.size = 0
+
+    def write(self, b):
+        start = time.perf_counter()
+        written = self.f.write(b)
+        self.time += time.perf_counter() - start
+        self.size += len(b)
+        return written
+
+def open_output(path):
+    # Never write through a hard link into a --store blob, replace the link instead
+    with contextlib.suppress(FileNotFoundError):
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    return open(path, 'wb')
+
+def write_chunks(path, chunks):
+    try:
+        with open_output(path) as f:
+            for chunk in chunks:
+                f.write(chunk)
+    except BaseException:
+        # Don't leave a partial file behind, --incremental only checks that it exists
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        raise
+
+class BlobStore:
+    """
+    Content-addressed store of extracted files (by SHA-1), the output tree only gets hard links
+    into it, so the same file extracted from several archives is only stored once.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def save(self, digest, chunks, out_path):
+        blob_path = self.blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = f'{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            write_chunks(tmp_path, chunks)
+            # Read-only, so editing a linked file in place can't change it for every other link
+            # (not on Windows, it couldn't delete the links to it for the next extraction then)
+            if os.name != 'nt':
+                os.chmod(tmp_path, stat.S_IREAD)
+            os.replace(tmp_path, blob_path)
+        self.link(blob_path, out_path)
+
+    def link(self, blob_path, out_path):
+        if os.path.lexists(out_path):
+            os.remove(out_path)
+        try:
+            os.link(blob_path, out_path)
+        except OSError:
+            # No hard links across drives or on this filesystem
+            shutil.copyfile(blob_path, out_path)
+
+class WriteBehind:
+    """
+    Runs the output file writes on background threads, holding at most budget bytes of pending data.
+    Every write is reported back by finished() once it's done, with the error it failed with.
+    """
+    def __init__(self, threads, budget):
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.budget = budget
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.done = []
+
+    def submit(self, key, write, size):
+        with self.condition:
+            # A single file bigger than the budget still goes through once nothing else is pending
+            while self.pending and self.pending + size > self.budget:
+                self.condition.wait()
+            self.pending += size
+        self.executor.submit(self.run, key, write, size)
+
+    def run(self, key, write, size):
+        error = None
+        try:
+            write()
+        except BaseException as ex:
+            error = f'{type(ex).__name__}: {ex}'
+        finally:
+            with self.condition:
+                self.pending -= size
+                self.done.append((key, error))
+                self.condition.notify_all()
+
+    def finished(self):
+        """Returns the (key, error) of the writes that finished since the last call, error is None if it succeeded."""
+        with self.condition:
+            done, self.done = self.done, []
+        return done
+
+    def close(self):
+        """Waits for every write, returns the ones that finished since finished() was last called."""
+        self.executor.shutdown(wait=True)
+        return self.finished()
+
+class PendingFile:
+    """Collects the data of an output file in memory, for a WriteBehind or a BlobStore to write."""
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+    def write(self, b):
+        self.chunks.append(b)
+        self.size += len(b)
+        return len(b)
+
+def extract_entry(data, fileIndex, entry, out_path, hashed=False, timed=False, write_behind=None, store=None):
+    """
+    Extracts one entry. Returns the SHA-1 of the written data if hashed (or store) is set, and the
+    (bytes_in, bytes_out, read, inflate, write) timings of the entry if timed is set.
+    With a WriteBehind, the file is only queued for writing (write is then the time spent
+    waiting for room in its budget), it's done once write_behind.finished() reports it.
+    """
+    offset, uncompressed_size, compressed_size, compressed = entry
+    print(f'Saving data from {fileIndex}')
+    hashed = hashed or store is not None
+    start = time.perf_counter()
+    cur_data = data[offset:offset+compressed_size]
+    if timed:
+        # Copy it out of the map, so that reading it from disk isn't counted as inflate time
+        cur_data = bytes(cur_data)
+    read_end = time.perf_counter()
+    pending = write_behind is not None or store is not None
+    with PendingFile() if pending else open_output(out_path) as out_f:
+        opened = time.perf_counter()
+        f = writer = TimingWriter(out_f)
+        if hashed:
+            f = HashingWriter(f)
+        if compressed:
+            # The entries are already spread over the worker processes, so the blocks of each are inflated in turn
+            for block in iter_kt_gz_buffer(cur_data, workers=1):
+                f.write(block)
+        else:
+            f.write(cur_data)
+        written = time.perf_counter()
+    digest = f.hash.hexdigest() if hashed else None
+    if pending:
+        if store is not None:
+            write = functools.partial(store.save, digest, out_f.chunks, out_path)
+        else:
+            write = functools.partial(write_chunks, out_path, out_f.chunks)
+        if write_behind is not None:
+            write_behind.submit(fileIndex, write, out_f.size)
+        else:
+            write()
+    closed = time.perf_counter()
+    if not timed:
+        return digest, None
+    write_time = (opened - read_end) + writer.time + (closed - written)
+    return digest, (compressed_size, writer.size, read_end - start, (written - opened) - writer.time, write_time)
 
-def main(argc, argv):
-    if argc != 1:
-        print(f'Usage: {argv[0]}')
+def finished_writes(finished, pending):
+    """Yields the results of the pending ({fileIndex: (digest, timings)}) entries whose writes finished."""
+    for fileIndex, error in finished:
+        yield fileIndex, *pending.pop(fileIndex), error
+
+def extract(jobs, data, hashed=False, timed=False, write_behind=None, store=None):
+    """
+    Yields the (fileIndex, digest, timings, error) of every job once its file is written, error is
+    only set if a WriteBehind failed to write it (other errors are raised right away).
+    """
+    pending = {}
+    for job in jobs:
+        result = extract_entry(data, *job, hashed, timed, write_behind, store)
+        if write_behind is None:
+            yield job[0], *result, None
+        else:
+            pending[job[0]] = result
+            yield from finished_writes(write_behind.finished(), pending)
+    if write_behind is not None:
+        yield from finished_writes(write_behind.close(), pending)
+
+# Every worker process maps DATA1 on its own once and keeps it for its lifetime
+worker_stack = contextlib.ExitStack()
+worker_data = None
+worker_options = (False, False, None, None)
+worker_pending = {}
+worker_barrier = None
+
+def init_worker(data_path, hashed, timed, writers, write_budget, store, barrier=None):
+    global worker_data, worker_options, worker_barrier
+    worker_data = worker_stack.enter_context(open_data(data_path))
+    write_behind = WriteBehind(writers, write_budget) if writers else None
+    worker_options = (hashed, timed, write_behind, store)
+    worker_barrier = barrier
+
+def extract_worker(job):
+    """Extracts one entry, returns the results of every entry of this worker that got written since the last call."""
+    fileIndex, digest, timings = job[0], *extract_entry(worker_data, *job, *worker_options)
+    write_behind = worker_options[2]
+    if write_behind is None:
+        return [(fileIndex, digest, timings, None)]
+    worker_pending[fileIndex] = (digest, timings)
+    return list(finished_writes(write_behind.finished(), worker_pending))
+
+def flush_worker(_):
+    """Waits for the writes of this worker, returns the results of the entries not returned yet."""
+    # Every worker waits here until all of them got one of these, so none of them gets two
+    worker_barrier.wait()
+    return list(finished_writes(worker_options[2].close(), worker_pending))
+
+def extract_parallel(jobs, data_path, processes, hashed=False, timed=False, writers=0, write_budget=0, store=None):
+    """Yields the (fileIndex, digest, timings, error) of every job once its file is written, like extract."""
+    # Hand out the entries in DATA1 order, so every worker reads mostly forward
+    work = sorted(jobs, key=lambda job: job[1][0])
+    barrier = multiprocessing.Barrier(processes) if writers else None
+    pool = multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(data_path, hashed, timed, writers, write_budget // processes, store, barrier))
+    try:
+        for results in pool.imap_unordered(extract_worker, work, chunksize=16):
+            yield from results
+        if writers:
+            # An entry only counts as extracted once its write finished, so every worker reports its last ones
+            for results in pool.imap_unordered(flush_worker, range(processes), chunksize=1):
+                yield from results
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def verify_entry(data, fileIndex, entry):
+    """Checks one entry without writing anything, returns None if it's intact, otherwise what's wrong with it."""
+    offset, uncompressed_size, compressed_size, compressed = entry
+    if offset + compressed_size > len(data):
+        return f'ends at 0x{offset + compressed_size:X}, past the end of DATA1 (0x{len(data):X})'
+    if not compressed:
+        return None
+    cur_data = data[offset:offset+compressed_size]
+    try:
+        header = parse_kt_gz_header(cur_data)
+        blocks_end = header.block_offsets[-1] + header.block_data_sizes[-1] if len(header) else 0
+        if blocks_end > compressed_size:
+            return f'blocks end at 0x{blocks_end:X}, past the end of the entry (0x{compressed_size:X})'
+        # Every block is checked against the size it should decompress to
+        for block in iter_kt_gz_buffer(cur_data, workers=1):
+            pass
+    except (KtGzError, NotImplementedError) as ex:
+        return f'{type(ex).__name__}: {ex}'
+    if header.total_size != uncompressed_size:
+        return f'decompresses to {header.total_size} bytes, but DATA0 says {uncompressed_size}'
+    return None
+
+def verify_worker(job):
+    return job[0], verify_entry(worker_data, *job)
+
+def verify(jobs, data_path, processes):
+    """Yields the (fileIndex, problem) of every (fileIndex, entry) job, problem is None for intact entries."""
+    work = sorted(jobs, key=lambda job: job[1][0])
+    if processes <= 1:
+        with open_data(data_path) as data:
+            for fileIndex, entry in work:
+                yield fileIndex, verify_entry(data, fileIndex, entry)
+        return
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(data_path, False, False, 0, 0, None)) as pool:
+        yield from pool.imap_unordered(verify_worker, work, chunksize=16)
+
+class ExtractStats:
+    """Collects the per-entry timings of extract_entry for --stats."""
+    PHASES = ('read', 'inflate', 'write')
+
+    def __init__(self):
+        self.entries = []
+
+    def add(self, fileIndex, timings):
+        self.entries.append((fileIndex, *timings))
+
+    def summary(self, elapsed, slowest=10):
+        bytes_in = sum(entry[1] for entry in self.entries)
+        bytes_out = sum(entry[2] for entry in self.entries)
+        phases = {phase: sum(entry[3 + i] for entry in self.entries) for i, phase in enumerate(self.PHASES)}
+        by_time = sorted(self.entries, key=lambda entry: sum(entry[3:]), reverse=True)[:slowest]
+        return {
+            'entries': len(self.entries),
+            'elapsed': elapsed,
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'mb_in_per_s': bytes_in / elapsed / 1e6 if elapsed else 0.0,
+            'mb_out_per_s': bytes_out / elapsed / 1e6 if elapsed else 0.0,
+            'entries_per_s': len(self.entries) / elapsed if elapsed else 0.0,
+            # summed over all worker processes, so these can add up to more than elapsed
+            'phases': phases,
+            'slowest': [dict(zip(('index', 'bytes_in', 'bytes_out', *self.PHASES), entry)) for entry in by_time],
+        }
+
+def print_stats(summary):
+    print(f"Extracted {summary['entries']} entries in {summary['elapsed']:.2f}s "
+          f"({summary['entries_per_s']:.1f} entries/s)")
+    print(f"  In:  {summary['bytes_in'] / 1e6:.1f} MB ({summary['mb_in_per_s']:.1f} MB/s)")
+    print(f"  Out: {summary['bytes_out'] / 1e6:.1f} MB ({summary['mb_out_per_s']:.1f} MB/s)")
+    total = sum(summary['phases'].values()) or 1.0
+    for phase, seconds in summary['phases'].items():
+        print(f"  {phase:<8} {seconds:8.2f}s ({seconds / total:.0%})")
+    if summary['slowest']:
+        print(f"Slowest {len(summary['slowest'])} entries:")
+        for entry in summary['slowest']:
+            seconds = sum(entry[phase] for phase in ExtractStats.PHASES)
+            print(f"  {entry['index']:>6}: {seconds:.3f}s, {entry['bytes_in']} -> {entry['bytes_out']} bytes "
+                  f"(read {entry['read']:.3f}s, inflate {entry['inflate']:.3f}s, write {entry['write']:.3f}s)")
+
+MANIFEST_PATH = 'out/manifest.json'
+STATS_PATH = 'out/stats.json'
+
+def load_manifest(path):
+    """Returns {fileIndex: [offset, uncompressed_size, compressed_size, compressed, sha1, out_path]} of the last run."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {int(fileIndex): record for fileIndex, record in json.load(f).items()}
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({str(fileIndex): manifest[fileIndex] for fileIndex in sorted(manifest)}, f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+
+def compare_manifest(manifest, entries):
+    """Returns the added, removed and changed indices of DATA0 since the manifest was written."""
+    current = {fileIndex: list(entry) for fileIndex, entry in enumerate(entries) if entry[2] != 0}
+    added = sorted(current.keys() - manifest.keys())
+    removed = sorted(manifest.keys() - current.keys())
+    changed = sorted(fileIndex for fileIndex in current.keys() & manifest.keys() if manifest[fileIndex][:4] != current[fileIndex])
+    return added, removed, changed
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_current(record, job, check_hash=False):
+    """Whether the output file of a job is still what the manifest record says was extracted there."""
+    fileIndex, entry, out_path = job
+    if record is None or record[:4] != list(entry) or record[5] != out_path or not os.path.isfile(out_path):
+        return False
+    offset, uncompressed_size, compressed_size, compressed = entry
+    if os.path.getsize(out_path) != (uncompressed_size if compressed else compressed_size):
+        return False
+    return not check_hash or file_sha1(out_path) == record[4]
+
+def format_indices(indices):
+    ranges = []
+    for fileIndex in indices:
+        if ranges and ranges[-1][1] == fileIndex - 1:
+            ranges[-1][1] = fileIndex
+        else:
+            ranges.append([fileIndex, fileIndex])
+    return ', '.join(str(first) if first == last else f'{first}-{last}' for first, last in ranges)
+
+def verify_archive(jobs, data_path, processes):
+    start = time.perf_counter()
+    problems = []
+    for fileIndex, problem in verify(((fileIndex, entry) for fileIndex, entry, out_path in jobs), data_path, processes):
+        if problem is not None:
+            print(f'{fileIndex}: {problem}')
+            problems.append(fileIndex)
+    print(f'Verified {len(jobs)} entries in {time.perf_counter() - start:.2f}s, {len(problems)} broken')
+    if problems:
+        print(f'Broken entries: {format_indices(sorted(problems))}')
         return 1
+    return 0
+
+def tally_tails(jobs, data_path):
+    """Prints how the last blocks of the compressed entries are stored, to find out when the game leaves them uncompressed."""
+    stats = TailStats()
+    problems = []
+    with open_data(data_path) as data:
+        for fileIndex, entry, out_path in sorted(jobs, key=lambda job: job[1][0]):
+            offset, uncompressed_size, compressed_size, compressed = entry
+            if not compressed or compressed_size == 0 or offset + compressed_size > len(data):
+                continue
+            try:
+                tail = inspect_tail(data[offset:offset+compressed_size])
+            except (KtGzError, NotImplementedError) as ex:
+                print(f'{fileIndex}: {type(ex).__name__}: {ex}')
+                problems.append(fileIndex)
+                continue
+            if tail:
+                stats.add(tail)
+    print('\n'.join(format_tail_stats(stats)))
+    if problems:
+        print(f'Unreadable entries: {format_indices(sorted(problems))}')
+        return 1
+    return 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Extract every entry of DATA1.bin (indexed by DATA0.bin) into the 'out' directory, named after filelist.csv.")
+    parser.add_argument("command", nargs="?", choices=["extract", "verify", "tails"], default="extract", help="extract (default), verify to only check that every entry decompresses correctly, without writing anything, "
+                        "or tails to tally which entries have an uncompressed last block")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes (0 = one per CPU core, default: 1)")
+    parser.add_argument("-i", "--index", action="append", default=[], help="Only extract this index or index range, e.g. 6341-7437 (can be repeated)")
+    parser.add_argument("-p", "--path", action="append", default=[], help="Only extract the files whose filelist.csv path matches this glob, e.g. 'nx/event/talk_event/script/*' (can be repeated)")
+    parser.add_argument("-l", "--list", action="append", default=[], help="Text file with one index, index range or path glob per line (can be repeated)")
+    parser.add_argument("--no-filelist", action="store_true", help="Don't use filelist.csv, save every file as out/<index>.bin (use this for DLC archives)")
+    parser.add_argument("--writers", type=int, default=0, help="Number of background threads writing the output files, so decompression doesn't wait for the disk (default: 0, write directly)")
+    parser.add_argument("--write-buffer", type=int, default=256, help="Maximum MB of data waiting to be written by --writers (default: 256, shared by all --jobs)")
+    parser.add_argument("--store", help=f"Save every distinct file only once in this directory, and hard link the output files to it (also keeps {MANIFEST_PATH})")
+    parser.add_argument("--stats", action="store_true", help=f"Report read/inflate/write timings and throughput, also saved as JSON to {STATS_PATH}")
+    parser.add_argument("--slowest", type=int, default=10, help="Number of slowest entries listed by --stats (default: 10)")
+    parser.add_argument("--incremental", action="store_true", help=f"Only extract the entries that changed since the last run (tracked in {MANIFEST_PATH})")
+    parser.add_argument("--check-hashes", action="store_true", help="With --incremental, also compare the SHA-1 of every existing file with the manifest (reads all of them)")
+    args = parser.parse_args(argv[1:])
+
+    processes = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    manifest = None
     try:
-        with open('DATA0.bin', 'rb') as meta:
-            with open('DATA1.bin', 'rb') as data:
-                extract(meta, data)
+        selection = Selection(patterns=[pattern.replace('\\', '/') for pattern in args.path])
+        for item in args.index:
+            selection.ranges.extend(parse_range(part) for part in item.split(','))
+        for list_file in args.list:
+            selection.add_list_file(list_file)
+
+        index = load_index('DATA0.bin', 'filelist.csv')
+        entries = index.entries()
+        # Files are written straight to their named path (filelist.py isn't needed afterwards),
+        # the ones not in filelist.csv still end up as out/<index>.bin
+        if args.no_filelist:
+            if selection.patterns:
+                raise ValueError('Path globs need filelist.csv, only index ranges can be used with --no-filelist')
+            names = None
+        else:
+            names = index.names
+        jobs = plan(entries, names, selection)
+
+        if args.command == 'verify':
+            return verify_archive(jobs, 'DATA1.bin', processes)
+        if args.command == 'tails':
+            return tally_tails(jobs, 'DATA1.bin')
+
+        if args.incremental or args.store:
+            manifest = load_manifest(MANIFEST_PATH)
+            added, removed, changed = compare_manifest(manifest, entries)
+            for fileIndex in removed:
+                del manifest[fileIndex]
+        if args.incremental:
+            for label, indices in (('Added', added), ('Removed', removed), ('Changed', changed)):
+                if indices:
+                    print(f'{label} ({len(indices)}): {format_indices(indices)}')
+            jobs = [job for job in jobs if not is_current(manifest.get(job[0]), job, args.check_hashes)]
+            print(f'{len(jobs)} entries to extract')
+
+        make_dirs(jobs)
+        out_paths = {fileIndex: (entry, out_path) for fileIndex, entry, out_path in jobs}
+        hashed = manifest is not None
+        store = BlobStore(args.store) if args.store else None
+        stats = ExtractStats() if args.stats else None
+        start = time.perf_counter()
+        write_budget = args.write_buffer * 1024 * 1024
+        failed = []
+        with contextlib.ExitStack() as stack:
+            if processes > 1:
+                results = extract_parallel(jobs, 'DATA1.bin', processes, hashed, args.stats, args.writers, write_budget, store)
+            else:
+                data = stack.enter_context(open_data('DATA1.bin'))
+                write_behind = None
+                if args.writers > 0:
+                    # Closed (and so waited for) before DATA1 is unmapped, the queued chunks can be views into it
+                    write_behind = WriteBehind(args.writers, write_budget)
+                    stack.callback(write_behind.close)
+                results = extract(jobs, data, hashed, args.stats, write_behind, store)
+            for fileIndex, digest, timings, error in results:
+                if error is not None:
+                    print(f'Failed to write {fileIndex} ({error})')
+                    failed.append(fileIndex)
+                    continue
+                if manifest is not None:
+                    entry, out_path = out_paths[fileIndex]
+                    manifest[fileIndex] = [*entry, digest, out_path]
+                if stats:
+                    stats.add(fileIndex, timings)
+
+        if stats:
+            summary = stats.summary(time.perf_counter() - start, args.slowest)
+            summary['jobs'] = processes
+            print_stats(summary)
+            os.makedirs(os.path.dirname(STATS_PATH), exist_ok=True)
+            with open(STATS_PATH, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+        if failed:
+            print(f'Failed to write {len(failed)} entries: {format_indices(sorted(failed))}')
+            return 1
     except Exception as ex:
         print(f'An error occurred ({type(ex).__name__}): {ex}')
         return 1
+    finally:
+        # Also keep what got extracted before an error, so the next run can continue from there
+        if manifest is not None:
+            save_manifest(MANIFEST_PATH, manifest)
     return 0
 
 if __name__ == '__main__':
-    sys.exit(main(len(sys.argv), sys.argv))
+    sys.exit(main(sys.argv))
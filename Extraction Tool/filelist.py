@@ -5,10 +5,13 @@ import csv
 def organize(filelist):
     reader = csv.reader(filelist, delimiter=',')
     header = next(reader)
+    directories = set()
     for row in reader:
         index = 'out/%s.bin' % (row[0])
         filename = 'out/%s/%s' % (row[2], row[1])
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        if row[2] not in directories:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            directories.add(row[2])
         if os.path.exists(index):
             os.rename(index, filename)
         else:
@@ -0,0 +1,291 @@
+import array
+import contextlib
+import io
+import os
+import sys
+
+from archive_fs import ArchiveFS, DEFAULT_FILELIST
+from repack import INDEX_FILENAME_RE
+
+# kt_codec (the KT-gz block format, shared with the other tools) is in the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kt_codec import KT_GZ_EXTENSION, KtGzFile, is_kt_gz, read_kt_gz_header
+
+
+class LooseLayer:
+    """
+    A directory of loose files standing in for archive entries, like the romfs/patchN directories of the
+    updates, e.g. patch4/nx/action/model/MC032_CatherineA_0_P_Body.bin.gz for entry 3176
+    ('nx/action/model/3176 - MC032_CatherineA_0_P_Body.bin'). Files are matched to the entries of index by
+    their 'Filepath/Filename', by that path without the '<index> - ' in front of the filename, or by a
+    filename that is '<index>.bin' or starts with '<index> - ' (like in repack.py). A '.gz' extension is left
+    out of the match when the file is KT-gz compressed, those are decompressed while reading. Files that
+    match no entry (ones the update adds) are listed in unmatched.
+    """
+
+    def __init__(self, directory, index):
+        self.directory = directory
+        # index: (path, compressed)
+        self.files = {}
+        self.unmatched = []
+        short_paths = {}
+        for file_index, name in enumerate(index.names):
+            filepath, _, filename = name.rpartition('/')
+            short_name = filename.partition(' - ')[2]
+            if short_name:
+                short_paths.setdefault(f'{filepath}/{short_name}', []).append(file_index)
+
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                rel_path = os.path.relpath(path, directory).replace('\\', '/')
+                compressed = False
+                if rel_path.lower().endswith(KT_GZ_EXTENSION):
+                    with open(path, 'rb') as f:
+                        compressed = is_kt_gz(f)
+                if compressed:
+                    rel_path = rel_path[:-len(KT_GZ_EXTENSION)]
+                file_index = index.by_path.get(rel_path)
+                if file_index is None and len(short_paths.get(rel_path, [])) == 1:
+                    file_index = short_paths[rel_path][0]
+                if file_index is None:
+                    match = INDEX_FILENAME_RE.match(rel_path.rpartition('/')[2])
+                    if match and int(match.group(1)) < len(index):
+                        file_index = int(match.group(1))
+                if file_index is None:
+                    self.unmatched.append(path)
+                    continue
+                if file_index in self.files:
+                    raise ValueError(f'Both {self.files[file_index][0]} and {path} are index {file_index}')
+                self.files[file_index] = path, compressed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # The files are opened on demand, there is nothing to keep open
+        pass
+
+    def _file(self, file_index):
+        if file_index not in self.files:
+            raise FileNotFoundError(f'{self.directory} has no file for entry {file_index}')
+        return self.files[file_index]
+
+    def exists(self, file_index):
+        return file_index in self.files
+
+    def is_compressed(self, file_index):
+        return self._file(file_index)[1]
+
+    def indices(self):
+        return sorted(self.files)
+
+    def size(self, file_index):
+        path, compressed = self._file(file_index)
+        if not compressed:
+            return os.path.getsize(path)
+        with open(path, 'rb') as f:
+            return read_kt_gz_header(f).total_size
+
+    def stored(self, file_index):
+        """Returns the file as it's stored (KT-gz data if it's compressed)."""
+        with open(self._file(file_index)[0], 'rb') as f:
+            return memoryview(f.read())
+
+    def open(self, file_index, buffering=io.DEFAULT_BUFFER_SIZE):
+        path, compressed = self._file(file_index)
+        if not compressed:
+            return open(path, 'rb', buffering)
+        raw = KtGzFile(path)
+        if buffering == 0:
+            return raw
+        return io.BufferedReader(raw, buffering)
+
+    def read(self, file_index):
+        with self.open(file_index) as f:
+            return f.read()
+
+
+def same_data(layer, other, file_index, chunk_size=0x100000):
+    """Checks whether two layers have the same data for an entry: stored the same way, or the same once decompressed."""
+    if layer.size(file_index) != other.size(file_index):
+        return False
+    if layer.is_compressed(file_index) == other.is_compressed(file_index):
+        with layer.stored(file_index) as stored, other.stored(file_index) as other_stored:
+            if stored == other_stored:
+                return True
+    with layer.open(file_index) as f, other.open(file_index) as other_f:
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk != other_f.read(chunk_size):
+                return False
+            if not chunk:
+                return True
+
+
+class LayeredArchive:
+    """
+    Several DATA0.bin/DATA1.bin pairs that use the same index numbers merged into one index, where
+    every index comes from the last layer that has data for it. Layers are given from the lowest
+    priority to the highest, e.g. [base, modded repack of it]. Directories without a DATA0.bin are
+    loose layers (see LooseLayer), like the romfs/patchN directories of the updates:
+
+        with LayeredArchive(['romfs', 'romfs/patch4', 'mods/repacked'], 'filelist.csv') as layers:
+            print(layers.which('IN_EventBaseInfo.bin'))
+            with layers.open('IN_EventBaseInfo.bin') as f:
+                ...
+
+    Every layer gets its names from the same filelist (none without it), the loose layers are matched
+    to the entries of the first layer, which has to be an archive. A DLC archive has its own index
+    numbers, which have nothing to do with the base game's, so it's never layered over the base game,
+    only over other versions of the same DLC archive (without a filelist).
+    """
+
+    def __init__(self, directories, filelist=None):
+        self.directories = list(directories)
+        self.layers = []
+        try:
+            for directory in self.directories:
+                if os.path.exists(os.path.join(directory, 'DATA0.bin')):
+                    self.layers.append(ArchiveFS(directory, filelist or False))
+                elif not self.layers:
+                    raise ValueError(f'{directory} has no DATA0.bin, the first layer has to be an archive '
+                                     f'(loose layers get their index numbers from it)')
+                else:
+                    self.layers.append(LooseLayer(directory, self.layers[0].index))
+        except BaseException:
+            self.close()
+            raise
+
+        # Which layer provides each index, 0xFF if none does
+        count = max((len(layer.index) for layer in self.layers if isinstance(layer, ArchiveFS)), default=0)
+        self.providers = array.array('B', [0xFF]) * count
+        for layer_number, layer in enumerate(self.layers):
+            for file_index in layer.indices():
+                self.providers[file_index] = layer_number
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Every layer gets closed, even if closing one of them fails
+        with contextlib.ExitStack() as stack:
+            for layer in self.layers:
+                stack.callback(layer.close)
+
+    def find(self, key):
+        """Resolves an index, a 'Filepath/Filename' path or a (unique) filename to an index."""
+        if isinstance(key, int) or key.isdigit():
+            file_index = int(key)
+            if not 0 <= file_index < len(self.providers):
+                raise KeyError(f'Index {file_index} is out of range (0-{len(self.providers) - 1})')
+            return file_index
+        # The names come from filelist.csv, so any layer resolves them the same way
+        return self.layers[0].index.find(key)
+
+    def which(self, key):
+        """Returns the number of the layer that provides an entry, or None if no layer has it."""
+        layer_number = self.providers[self.find(key)]
+        return None if layer_number == 0xFF else layer_number
+
+    def layers_with(self, key):
+        """Returns the numbers of every layer that has data for an entry, the last one is used."""
+        file_index = self.find(key)
+        return [layer_number for layer_number, layer in enumerate(self.layers) if layer.exists(file_index)]
+
+    def overridden_layers(self, key):
+        """Returns the numbers of the lower layers whose data for an entry differs from the one that's used."""
+        file_index = self.find(key)
+        *lower, top = self.layers_with(file_index) or [None]
+        return [layer_number for layer_number in lower
+                if not same_data(self.layers[top], self.layers[layer_number], file_index)]
+
+    def overridden(self):
+        """
+        Returns the indices where the data that's used differs from that of a lower layer. Layers that
+        only have a copy of the same data (e.g. every untouched entry of a repack) don't count.
+        """
+        counts = array.array('B', [0]) * len(self.providers)
+        for layer in self.layers:
+            for file_index in layer.indices():
+                counts[file_index] += 1
+        return [file_index for file_index, count in enumerate(counts)
+                if count > 1 and self.overridden_layers(file_index)]
+
+    def layer(self, key):
+        layer_number = self.which(key)
+        if layer_number is None:
+            raise FileNotFoundError(f'No layer has data for {key}')
+        return self.layers[layer_number]
+
+    def open(self, key, buffering=io.DEFAULT_BUFFER_SIZE):
+        file_index = self.find(key)
+        return self.layer(file_index).open(file_index, buffering)
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+
+def main(argv):
+    import argparse
+    import shutil
+
+    parser = argparse.ArgumentParser(description="Find out which of several DATA0/DATA1 pairs with the same index numbers (e.g. the base game, its patches and modded repacks of it) provides a file.")
+    parser.add_argument("layers", nargs="+", help="Directories with DATA0.bin and DATA1.bin, or with loose files replacing entries (like romfs/patch4), from the lowest priority to the highest (e.g. romfs romfs/patch4 repacked). The first one has to have DATA0.bin")
+    parser.add_argument("--filelist", default=DEFAULT_FILELIST, help="filelist.csv with the names of the base game files (default: the one next to this script)")
+    parser.add_argument("--dlc", action="store_true", help="The layers are versions of a DLC archive, which has its own index numbers, so filelist.csv isn't used")
+    parser.add_argument("-w", "--which", action="append", default=[], help="Index, 'Filepath/Filename' or filename to look up (can be repeated)")
+    parser.add_argument("--overrides", action="store_true", help="List every index where the data that's used differs from that of a lower layer")
+    parser.add_argument("--get", help="Copy the newest version of this file out of the archives")
+    parser.add_argument("-o", "--output", help="Output file path for --get (default: the filename)")
+    args = parser.parse_args(argv[1:])
+
+    try:
+        with LayeredArchive(args.layers, None if args.dlc else args.filelist) as layers:
+            names = layers.layers[0].index
+            for key in args.which:
+                try:
+                    file_index = layers.find(key)
+                except KeyError as ex:
+                    print(ex.args[0])
+                    continue
+                found_in = layers.layers_with(file_index)
+                name = names.name(file_index) if file_index < len(names) else None
+                if not found_in:
+                    print(f'{file_index} ({name or "unknown"}): not in any layer')
+                    continue
+                print(f'{file_index} ({name or "unknown"}): {args.layers[found_in[-1]]}')
+                overridden = layers.overridden_layers(file_index)
+                if overridden:
+                    print('  overrides: ' + ', '.join(args.layers[layer_number] for layer_number in overridden))
+                same = [layer_number for layer_number in found_in[:-1] if layer_number not in overridden]
+                if same:
+                    print('  same data as: ' + ', '.join(args.layers[layer_number] for layer_number in same))
+            if args.overrides:
+                for file_index in layers.overridden():
+                    name = names.name(file_index) if file_index < len(names) else None
+                    found_in = ', '.join(args.layers[layer_number] for layer_number in layers.overridden_layers(file_index))
+                    print(f'{file_index}\t{name or ""}\t{args.layers[layers.which(file_index)]}\t{found_in}')
+            if args.get:
+                file_index = layers.find(args.get)
+                name = names.name(file_index) if file_index < len(names) else None
+                output = args.output or (name or f'{file_index}.bin').rpartition('/')[2]
+                with layers.open(file_index) as f, open(output, 'wb') as out_f:
+                    shutil.copyfileobj(f, out_f)
+                print(f'Saved {file_index} from {args.layers[layers.which(file_index)]} to {output}')
+    except Exception as ex:
+        print(f'An error occurred ({type(ex).__name__}): {ex}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,201 @@
+import concurrent.futures
+import os
+import re
+import struct
+import sys
+
+from data_index import load_index, DATA0_ENTRY_STRUCT
+from extractIndexNum import open_data
+
+# kt_codec (the KT-gz block format, shared with the other tools) is in the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kt_codec import compress_kt_gz_buffer
+
+# New entries start on this boundary in DATA1
+DATA1_ALIGN = 0x100
+INDEX_FILENAME_RE = re.compile(r'^(\d+)(?:\.bin$| - )')
+
+
+def data1_align(offset):
+    return (offset + DATA1_ALIGN - 1) & ~(DATA1_ALIGN - 1)
+
+
+def find_replacements(replace_dir, index):
+    """
+    Maps every file in replace_dir to the index it replaces. Files are matched by their
+    'Filepath/Filename' from filelist.csv (the same tree extractIndexNum.py writes), or
+    by their filename when it is '<index>.bin' or starts with '<index> - '.
+    """
+    replacements = {}
+    for root, dirs, files in os.walk(replace_dir):
+        for filename in files:
+            path = os.path.join(root, filename)
+            rel_path = os.path.relpath(path, replace_dir).replace('\\', '/')
+            file_index = index.by_path.get(rel_path)
+            if file_index is None:
+                match = INDEX_FILENAME_RE.match(filename)
+                if not match:
+                    print(f'Warning: skipping {rel_path}, it does not match any index')
+                    continue
+                file_index = int(match.group(1))
+            if file_index >= len(index):
+                raise ValueError(f'{rel_path} is index {file_index}, but DATA0.bin only has {len(index)} entries')
+            if file_index in replacements:
+                raise ValueError(f'Index {file_index} is replaced by both {replacements[file_index]} and {path}')
+            replacements[file_index] = path
+    return replacements
+
+
+def compress_file(path, level, raw_tail=False):
+    # Every replacement is compressed in its own process already, so its blocks are compressed in turn
+    with open(path, 'rb') as f:
+        return compress_kt_gz_buffer(f.read(), level, workers=1, raw_tail=raw_tail)
+
+
+def submit_replacements(executor, index, replacements, level, raw_tail=False):
+    # Originally compressed (or empty) entries get compressed, uncompressed ones stay that way
+    return {file_index: executor.submit(compress_file, path, level, raw_tail) for file_index, path in replacements.items()
+            if index.entry(file_index)[3] or index.entry(file_index)[2] == 0}
+
+
+def read_replacement(file_index, path, futures):
+    """Returns the payload, uncompressed size and compressed flag of a replacement."""
+    if file_index in futures:
+        print(f'Compressing {file_index} from {path}')
+        payload = futures.pop(file_index).result()
+        return payload, os.path.getsize(path), True
+    print(f'Storing {file_index} from {path}')
+    with open(path, 'rb') as f:
+        payload = f.read()
+    return payload, len(payload), False
+
+
+def repack(index, data0_path, data1_path, replacements, out_dir, level=9, jobs=1, raw_tail=False):
+    """
+    Writes a new DATA0.bin/DATA1.bin pair to out_dir with the replacements ({index: path}) applied.
+    Untouched entries are copied byte-for-byte, only the replacements get (re)compressed.
+    """
+    with open(data0_path, 'rb') as f:
+        records = bytearray(f.read(len(index) * DATA0_ENTRY_STRUCT.size))
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_data0_path = os.path.join(out_dir, 'DATA0.bin')
+    out_data1_path = os.path.join(out_dir, 'DATA1.bin')
+    for in_path, out_path in ((data0_path, out_data0_path), (data1_path, out_data1_path)):
+        if os.path.exists(out_path) and os.path.samefile(in_path, out_path):
+            raise ValueError(f'The output would overwrite the original {in_path}')
+
+    with open_data(data1_path) as data, open(out_data1_path, 'wb') as out_f, \
+            concurrent.futures.ProcessPoolExecutor(max(1, jobs)) as executor:
+        futures = submit_replacements(executor, index, replacements, level, raw_tail)
+
+        # Entries keep their order in DATA1, the ones sharing the same data keep sharing it
+        order = sorted((file_index for file_index in range(len(index))
+                        if index.entry(file_index)[2] != 0 or file_index in replacements),
+                       key=lambda file_index: index.entry(file_index)[0])
+        copied = {}
+        for file_index in order:
+            offset, uncompressed_size, compressed_size, compressed = index.entry(file_index)
+            if file_index in replacements:
+                payload, uncompressed_size, compressed = read_replacement(file_index, replacements[file_index], futures)
+                new_offset = data1_align(out_f.tell())
+                out_f.write(bytes(new_offset - out_f.tell()))
+                out_f.write(payload)
+                compressed_size = len(payload)
+            elif (offset, compressed_size) in copied:
+                new_offset = copied[(offset, compressed_size)]
+            else:
+                new_offset = data1_align(out_f.tell())
+                out_f.write(bytes(new_offset - out_f.tell()))
+                out_f.write(data[offset:offset + compressed_size])
+                copied[(offset, compressed_size)] = new_offset
+            # Only the known fields are rewritten, the padding of each record is kept as it was
+            struct.pack_into('<QQQ?', records, file_index * DATA0_ENTRY_STRUCT.size,
+                             new_offset, uncompressed_size, compressed_size, compressed)
+        out_f.write(bytes(data1_align(out_f.tell()) - out_f.tell()))
+
+    with open(out_data0_path, 'wb') as f:
+        f.write(records)
+    print(f'Wrote {out_data0_path} and {out_data1_path} with {len(replacements)} replaced entries')
+
+
+def append(index, data0_path, data1_path, replacements, level=9, jobs=1, raw_tail=False):
+    """
+    Applies the replacements ({index: path}) in place: their data is appended to the end of DATA1.bin,
+    and only their DATA0.bin records are rewritten. The data they replaced stays in DATA1.bin as
+    dead space until the archive is compacted (repack with no replacements).
+    """
+    updated = {}
+    with open(data1_path, 'r+b') as out_f, concurrent.futures.ProcessPoolExecutor(max(1, jobs)) as executor:
+        futures = submit_replacements(executor, index, replacements, level, raw_tail)
+        out_f.seek(0, os.SEEK_END)
+        for file_index in sorted(replacements):
+            payload, uncompressed_size, compressed = read_replacement(file_index, replacements[file_index], futures)
+            new_offset = data1_align(out_f.tell())
+            out_f.write(bytes(new_offset - out_f.tell()))
+            out_f.write(payload)
+            updated[file_index] = (new_offset, uncompressed_size, len(payload), compressed)
+        out_f.write(bytes(data1_align(out_f.tell()) - out_f.tell()))
+        # The new data has to be on disk before DATA0 points to it
+        out_f.flush()
+        os.fsync(out_f.fileno())
+
+    with open(data0_path, 'r+b') as f:
+        for file_index, record in sorted(updated.items()):
+            f.seek(file_index * DATA0_ENTRY_STRUCT.size)
+            f.write(struct.pack('<QQQ?', *record))
+    print(f'Appended {len(updated)} entries to {data1_path} and updated their records in {data0_path}')
+
+
+def dead_space(index, data1_path):
+    """Returns how many bytes of DATA1.bin are not used by any entry."""
+    used = {(offset, compressed_size) for offset, uncompressed_size, compressed_size, compressed in index.entries()
+            if compressed_size != 0}
+    return os.path.getsize(data1_path) - sum(compressed_size for offset, compressed_size in used)
+
+
+def main(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Rebuild DATA0.bin/DATA1.bin with replacement files.")
+    parser.add_argument("directory", nargs="?", help="Directory with the replacement files, named like the extracted ones ('Filepath/Filename' or '<index>.bin')")
+    parser.add_argument("-o", "--output", default="repacked", help="Output directory for the new DATA0.bin and DATA1.bin (default: repacked)")
+    parser.add_argument("--append", action="store_true", help="Modify --data0/--data1 in place, appending the replacements to the end of DATA1.bin")
+    parser.add_argument("--compact", action="store_true", help="Rebuild --data0/--data1 into --output without the dead space left behind by --append")
+    parser.add_argument("--data0", default="DATA0.bin", help="Original DATA0.bin (default: DATA0.bin)")
+    parser.add_argument("--data1", default="DATA1.bin", help="Original DATA1.bin (default: DATA1.bin)")
+    parser.add_argument("--filelist", default="filelist.csv", help="filelist.csv used to match the file paths (default: filelist.csv)")
+    parser.add_argument("--no-filelist", action="store_true", help="Only match files by their index (use this for DLC archives)")
+    parser.add_argument("-l", "--level", type=int, default=9, help="Compression level (0-9, default: 9)")
+    parser.add_argument("--raw-tail", action="store_true", help="Store the last block of a replacement uncompressed when deflate doesn't shrink it (like the game does)")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="Number of worker processes compressing the replacements (default: 0, one per CPU core)")
+    args = parser.parse_args(argv[1:])
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count() or 1
+    if args.compact == bool(args.directory):
+        parser.error("either a directory with replacement files or --compact is needed")
+    if args.compact and args.append:
+        parser.error("--compact and --append can't be used together")
+
+    try:
+        index = load_index(args.data0, None if args.no_filelist else args.filelist)
+        if args.compact:
+            print(f'{dead_space(index, args.data1)} bytes of {args.data1} are not used by any entry')
+            repack(index, args.data0, args.data1, {}, args.output)
+            return 0
+        replacements = find_replacements(args.directory, index)
+        if not replacements:
+            print(f'No replacement files found in {args.directory}')
+            return 1
+        if args.append:
+            append(index, args.data0, args.data1, replacements, args.level, jobs, args.raw_tail)
+        else:
+            repack(index, args.data0, args.data1, replacements, args.output, args.level, jobs, args.raw_tail)
+    except Exception as ex:
+        print(f'An error occurred ({type(ex).__name__}): {ex}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -2,12 +2,17 @@ import os
 import struct
 import sys
 
+# kt_codec (the KT-gz block format, shared with the other tools) is in the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kt_codec import is_kt_gz, KtGzFile
+
 def unpack_sections(input_file_path, output_dir):
     """
     Unpacks sections from a binary file based on the provided structure.
 
     Args:
-        input_file_path (str): The path to the binary file to unpack.
+        input_file_path (str): The path to the binary file to unpack, either a decompressed .bin or the
+            compressed .bin.gz itself.
         output_dir (str): The directory where the unpacked sections will be saved.
     """
     # Define the magic byte sequences for file type identification
@@ -24,7 +29,12 @@ def unpack_sections(input_file_path, output_dir):
             os.makedirs(output_dir)
             print(f"Created output directory: {output_dir}")
 
-        with open(input_file_path, 'rb') as f:
+        with open(input_file_path, 'rb') as raw_f:
+            # A compressed .bin.gz is read in place, without decompressing it to a file first
+            f = KtGzFile(raw_f) if is_kt_gz(raw_f) else raw_f
+            if f is not raw_f:
+                print("Input is KT-gz compressed, reading it in place.")
+
             # Read the number of entries (4 bytes, little-endian)
             entry_count_data = f.read(4)
             if len(entry_count_data) < 4:
@@ -4,12 +4,18 @@ import io
 import shutil
 import subprocess
 from g1t_repack import rebuild_g1t
-from kt_gz import compress_kt_gz
+from kt_arc import read_bin_file
+from kt_gz import compress_kt_gz_stream, is_kt_gz, read_chunks, read_reference_blocks, set_codec, CODEC_LOADERS, \
+    AUTO_LEVEL, format_trials, parse_level, sample_blocks, tune_compression
 
-def batch_rebuild_and_pack(input_dir, output_bin, compress_lvl=0):
+def batch_rebuild_and_pack(input_dir, output_bin, compress_lvl=0, reference_bin=None, raw_tail=False):
     temp_dir = os.path.join(input_dir, "_repacked_temp")
     os.makedirs(temp_dir, exist_ok=True)
 
+    # Compressed entries of the original BIN, their unchanged blocks don't need to be compressed again
+    reference_entries = read_bin_file(reference_bin) if reference_bin else []
+
+    rebuilt = []
     for filename in sorted(os.listdir(input_dir)):
         if not filename.endswith(".g1t"):
             continue
@@ -24,11 +30,29 @@ def batch_rebuild_and_pack(input_dir, output_bin, compress_lvl=0):
             raise FileNotFoundError(f"Missing folder: {dds_folder}")
 
         rebuild_g1t(g1t_path, dds_folder, rebuilt_path)
+        rebuilt.append((base, rebuilt_path))
+
+    strategy = None
+    if compress_lvl == AUTO_LEVEL:
+        # Try the levels on some blocks of the rebuilt files, the original BIN's size is the budget
+        samples, total_size = sample_blocks([rebuilt_path for base, rebuilt_path in rebuilt])
+        budget = sum(len(entry) for entry in reference_entries) if reference_entries else None
+        best, trials, budget = tune_compression(samples, total_size, budget)
+        for line in format_trials(best, trials, budget):
+            print(f"[INFO] {line}")
+        compress_lvl, strategy = best.level, best.strategy
+
+    for base, rebuilt_path in rebuilt:
         # gzip compress it into another temp folder
         gz_path = os.path.join(temp_dir, f"{base}.bin.gz")
+        reference = None
+        if base.isdigit() and int(base) < len(reference_entries):
+            reference_stream = io.BytesIO(reference_entries[int(base)])
+            if is_kt_gz(reference_stream):
+                reference = read_reference_blocks(reference_stream)
         with open(rebuilt_path, "rb") as in_f, open(gz_path, "wb") as out_f:
-            in_buf = io.BytesIO(in_f.read())
-            compress_kt_gz(in_buf, out_f, in_buf.getbuffer().nbytes, level=compress_lvl)
+            compress_kt_gz_stream(read_chunks(in_f), out_f, level=compress_lvl, reference=reference, strategy=strategy,
+                                  raw_tail=raw_tail)
 
         # remove the uncompressed .g1t file to avoid including non-gzipped files
         os.remove(rebuilt_path)
@@ -51,11 +75,19 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Batch-rebuild G1T files and pack into BIN.")
     parser.add_argument("directory", help="Path to directory with .g1t files and subfolders of DDS.")
     parser.add_argument("output", help="Output BIN file path.")
-    parser.add_argument("--level", type=int, default=9, help="Compression level (0-9, default: 9) - recommendation: use 9 to get same or similar size")
+    parser.add_argument("--level", type=parse_level, default=9, help="Compression level (0-9, default: 9) - recommendation: use 9 to get same or similar size, "
+                        "or auto to use the fastest level that stays within the size of --reference (or of level 9)")
+    parser.add_argument("--reference", help="Original BIN file, the blocks of the G1T files that didn't change are copied from it instead of compressed again")
+    parser.add_argument("--raw-tail", action="store_true", help="Store the last block of a G1T uncompressed when deflate doesn't shrink it, "
+                        "or when the original one in --reference is stored that way")
+    parser.add_argument("--codec", default=os.environ.get("KT_GZ_CODEC", "auto"), choices=["auto", *CODEC_LOADERS],
+                        help="Deflate implementation (default: auto, the fastest installed one of zlib-ng, libdeflate and zlib)")
 
     args = parser.parse_args()
 
     try:
-        batch_rebuild_and_pack(args.directory, args.output, compress_lvl=args.level)
+        set_codec(args.codec)
+        batch_rebuild_and_pack(args.directory, args.output, compress_lvl=args.level, reference_bin=args.reference,
+                               raw_tail=args.raw_tail)
     except Exception as e:
         print(f"[ERROR] {e}")
\ No newline at end of file
@@ -5,7 +5,7 @@ import subprocess
 import zlib
 from typing import Tuple, Optional, Dict, Any
 from PIL import Image # for PNG export (RGBA8, BGRA8 only)
-from kt_gz import decompress_kt_gz # For unpacking GZ files
+from kt_gz import decompress_kt_gz, is_kt_gz, KtGzFile # For unpacking GZ files
 
 # Load custom shared G1T info
 import g1t
@@ -345,8 +345,10 @@ def decompress_kt_gz_data(data: bytes) -> bytes:
     return output_stream.getvalue()
 
 def try_unpack_bin(bin_path: str) -> Optional[list]:
-    """Try to unpack a BIN file that contains embedded G1T/BIN files."""
-    with open(bin_path, "rb") as f:
+    """Try to unpack a BIN file that contains embedded G1T/BIN files (the file itself may be compressed)."""
+    with open(bin_path, "rb") as raw_f:
+        # A compressed BIN is read in place, only the blocks with the table and the entries get inflated
+        f = KtGzFile(raw_f) if is_kt_gz(raw_f) else raw_f
         num_files_bytes = f.read(4)
         if len(num_files_bytes) < 4:
             return None
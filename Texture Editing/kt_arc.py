@@ -17,6 +17,18 @@ def read_files_sorted(in_dir):
     return [path for _, path in sorted(files)]
 
 
+def read_bin_file(in_path):
+    """Returns the data of every entry of a BIN container."""
+    with open(in_path, "rb") as f:
+        file_count = struct.unpack("<I", f.read(4))[0]
+        entries = [KT_ARC_ENTRY_STRUCT.unpack(f.read(KT_ARC_ENTRY_STRUCT.size)) for _ in range(file_count)]
+        file_data = []
+        for offset, size in entries:
+            f.seek(offset)
+            file_data.append(f.read(size))
+    return file_data
+
+
 def pack_bin_file(file_paths, out_path):
     file_count = len(file_paths)
     header_size = 4 + file_count * 8
@@ -0,0 +1,33 @@
+"""
+KT-gz compression shared by all the tools: the standalone .gz files (textures, models) and the
+compressed DATA1.bin entries use the same block format, so both are read and written here.
+
+Tools outside the root of the repository add it to sys.path first:
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    from kt_codec import KtGzFile, decompress_kt_gz
+"""
+
+from .deflate import DeflateCodec, CODEC_LOADERS, AUTO_CODECS, load_codec
+from .kt_gz import (
+    KT_GZ_BLOCK_SIZE, KT_GZ_HEADER_STRUCT, KT_GZ_EXTENSION, RAW_TAIL_MAX_SIZE, KtGzError, KtGzHeader, KtGzFile,
+    set_codec, get_codec, align_0x80, map_blocks, split_blocks, read_chunks, compress_blocks, write_kt_gz,
+    compress_kt_gz, compress_kt_gz_stream, compress_kt_gz_buffer, compress_kt_gz_file,
+    parse_kt_gz_header, read_kt_gz_header, decompress_block, read_stored_blocks, buffer_stored_blocks,
+    decompress_blocks, read_kt_gz_blocks, ReferenceBlocks, read_reference_blocks, decompress_kt_gz, iter_kt_gz_buffer,
+    decompress_kt_gz_buffer, read_kt_gz_range, is_kt_gz, decompress_kt_gz_file,
+)
+from .tuning import AUTO_LEVEL, CompressionTrial, parse_level, sample_blocks, tune_compression, format_trials
+from .tails import TAIL_SIZE_BUCKETS, inspect_tail, TailStats, format_tail_stats
+
+__all__ = [
+    "DeflateCodec", "CODEC_LOADERS", "AUTO_CODECS", "load_codec",
+    "KT_GZ_BLOCK_SIZE", "KT_GZ_HEADER_STRUCT", "KT_GZ_EXTENSION", "RAW_TAIL_MAX_SIZE", "KtGzError", "KtGzHeader", "KtGzFile",
+    "set_codec", "get_codec", "align_0x80", "map_blocks", "split_blocks", "read_chunks", "compress_blocks", "write_kt_gz",
+    "compress_kt_gz", "compress_kt_gz_stream", "compress_kt_gz_buffer", "compress_kt_gz_file",
+    "parse_kt_gz_header", "read_kt_gz_header", "decompress_block", "read_stored_blocks", "buffer_stored_blocks",
+    "decompress_blocks", "read_kt_gz_blocks", "ReferenceBlocks", "read_reference_blocks", "decompress_kt_gz", "iter_kt_gz_buffer",
+    "decompress_kt_gz_buffer", "read_kt_gz_range", "is_kt_gz", "decompress_kt_gz_file",
+    "AUTO_LEVEL", "CompressionTrial", "parse_level", "sample_blocks", "tune_compression", "format_trials",
+    "TAIL_SIZE_BUCKETS", "inspect_tail", "TailStats", "format_tail_stats",
+]
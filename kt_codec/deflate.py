@@ -0,0 +1,90 @@
+import importlib
+import zlib
+
+
+class DeflateCodec:
+    """
+    One zlib-format deflate implementation. Every block of a KT-gz file is a plain zlib stream,
+    so any of them produces files the game reads, even if the compressed bytes differ.
+    """
+
+    def __init__(self, name, compress, decompress, error, levels=range(1, 10), strategies=()):
+        self.name = name
+        self._compress = compress
+        self._decompress = decompress
+        self.error = error  # what decompress raises on broken data
+        self.levels = levels  # the useful levels, slowest last
+        self.strategies = tuple(strategies)  # names of the deflate strategies it has besides the default one
+
+    def compress(self, data, level=-1, strategy=None):
+        if strategy is not None and strategy != "default" and strategy not in self.strategies:
+            raise ValueError(f"{self.name} has no {strategy} strategy, choose from: default, {', '.join(self.strategies)}")
+        return self._compress(data, level, strategy)
+
+    def decompress(self, data, size):
+        """Decompresses a block, size is the exact decompressed size of it."""
+        return self._decompress(data, size)
+
+
+def _zlib_codec(name, module):
+    strategies = {"filtered": module.Z_FILTERED, "rle": module.Z_RLE}
+
+    def compress(data, level, strategy):
+        if strategy in strategies:
+            compressor = module.compressobj(level, module.DEFLATED, module.MAX_WBITS, module.DEF_MEM_LEVEL, strategies[strategy])
+            return compressor.compress(data) + compressor.flush()
+        return module.compress(data, level)
+
+    return DeflateCodec(name, compress, lambda data, size: module.decompress(data, bufsize=max(size, 1)),
+                        module.error, strategies=strategies)
+
+
+def _load_zlib_ng():
+    return _zlib_codec("zlib-ng", importlib.import_module("zlib_ng.zlib_ng"))
+
+
+def _load_libdeflate():
+    deflate = importlib.import_module("deflate")
+
+    def compress(data, level, strategy):
+        return bytes(deflate.zlib_compress(data, 6 if level < 0 else level))
+
+    def decompress(data, size):
+        return bytes(deflate.zlib_decompress(data, size))
+
+    # libdeflate goes up to level 12
+    return DeflateCodec("libdeflate", compress, decompress, deflate.DeflateError, levels=range(1, 13))
+
+
+def _load_isal():
+    isal_zlib = importlib.import_module("isal.isal_zlib")
+
+    def compress(data, level, strategy):
+        # ISA-L only has levels 0-3, so zlib's 1-9 are spread over those
+        return isal_zlib.compress(data, isal_zlib.ISAL_DEFAULT_COMPRESSION if level < 0 else min(3, (level + 2) // 3))
+
+    return DeflateCodec("isal", compress, lambda data, size: isal_zlib.decompress(data, bufsize=max(size, 1)),
+                        isal_zlib.error, levels=(1, 4, 7))
+
+
+CODEC_LOADERS = {
+    "zlib-ng": _load_zlib_ng,
+    "libdeflate": _load_libdeflate,
+    "isal": _load_isal,
+    "zlib": lambda: _zlib_codec("zlib", zlib),
+}
+# isal is left out of the automatic choice, its levels don't match the sizes zlib level 9 gives
+AUTO_CODECS = ("zlib-ng", "libdeflate", "zlib")
+
+
+def load_codec(name="auto"):
+    """Returns the named codec, or with "auto" the fastest one that's installed (stdlib zlib at least)."""
+    if name != "auto":
+        if name not in CODEC_LOADERS:
+            raise ValueError(f"Unknown codec {name}, choose from: auto, {', '.join(CODEC_LOADERS)}")
+        return CODEC_LOADERS[name]()
+    for candidate in AUTO_CODECS:
+        try:
+            return CODEC_LOADERS[candidate]()
+        except ImportError:
+            continue
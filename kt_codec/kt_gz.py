@@ -0,0 +1,551 @@
+import collections
+import concurrent.futures
+import hashlib
+import io
+import os
+import struct
+from typing import BinaryIO
+
+from .deflate import load_codec
+
+KT_GZ_BLOCK_SIZE = 0x10000
+KT_GZ_HEADER_STRUCT = struct.Struct("<iII")
+KT_GZ_EXTENSION = ".gz"
+# A zlib stream and its 4-byte size never take fewer than 12 bytes, so deflate can't shrink anything smaller
+RAW_TAIL_MAX_SIZE = 11
+
+
+class KtGzError(ValueError):
+    """Raised for KT-gz data that is broken or doesn't add up."""
+
+
+codec = load_codec(os.environ.get("KT_GZ_CODEC", "auto"))
+
+
+def set_codec(name):
+    """Switches the codec used for every KT-gz block (same names as the KT_GZ_CODEC variable)."""
+    global codec
+    codec = load_codec(name)
+    return codec
+
+
+def get_codec():
+    return codec
+
+
+def align_0x80(offset):
+    return (offset + 0x7F) & ~0x7F
+
+
+def map_blocks(function, arguments, workers=None):
+    """
+    Yields function(*args) for every item of arguments in order, running up to workers of them
+    (default: one per CPU core) at once on threads. zlib and the other codecs don't hold the GIL
+    while (de)compressing, so blocks really are processed side by side.
+    """
+    arguments = iter(arguments)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for args in arguments:
+            yield function(*args)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        # Only read ahead a few blocks per worker, so the whole input isn't held in memory
+        pending = collections.deque()
+        for args in arguments:
+            pending.append(executor.submit(function, *args))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def block_count_for(total_size):
+    # Empty data still gets one (empty) block
+    return max(1, (total_size + KT_GZ_BLOCK_SIZE - 1) // KT_GZ_BLOCK_SIZE)
+
+
+def split_blocks(chunks):
+    """Yields (data, is_last) for every block of the data in chunks, which can be of any size."""
+    pending = bytearray()
+    previous = None
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) > KT_GZ_BLOCK_SIZE:
+            # only once more data follows it is known that a block isn't the last one
+            if previous is not None:
+                yield previous, False
+            previous = bytes(pending[:KT_GZ_BLOCK_SIZE])
+            del pending[:KT_GZ_BLOCK_SIZE]
+    if previous is not None:
+        yield previous, not pending
+    if pending or previous is None:
+        yield bytes(pending), True
+
+
+def read_chunks(in_stream: BinaryIO, chunk_size=KT_GZ_BLOCK_SIZE):
+    """Yields the data of in_stream (a file, pipe or socket) in chunks until it ends."""
+    return iter(lambda: in_stream.read(chunk_size), b'')
+
+
+def compress_blocks(blocks, level=-1, workers=None, reference_blocks=None, strategy=None, raw_tail=False):
+    """
+    Yields the (data, compressed) of every (data, is_last) block in order, every block is compressed on its own.
+    Blocks found in reference_blocks (see read_reference_blocks) keep their stored data from there instead.
+    strategy is one of the codec's deflate strategies (e.g. "filtered"), None for the default one.
+    With raw_tail, the last block is stored uncompressed like KT sometimes does: when deflate doesn't make
+    it smaller, or when the last block of the reference is uncompressed too.
+    """
+    reference_raw_tail = not getattr(reference_blocks, "last_block_compressed", True)
+
+    def compress_block(data, is_last):
+        stored = None
+        if reference_blocks:
+            stored = reference_blocks.get(hashlib.sha1(data).digest())
+            # an uncompressed block can only be the last one
+            if stored and not (stored[1] or is_last):
+                stored = None
+        if raw_tail and is_last and not stored and (len(data) <= RAW_TAIL_MAX_SIZE or reference_raw_tail):
+            # no point deflating it
+            return bytes(data), False
+        block_data, compressed = stored or (codec.compress(data, level, strategy), True)
+        if is_last and compressed and len(block_data) + 4 == len(data):
+            # It would be read back as an uncompressed last block (see parse_kt_gz_header),
+            # so it's stored that way, which takes exactly the same space
+            return bytes(data), False
+        if is_last and compressed and raw_tail and len(block_data) + 4 > len(data):
+            return bytes(data), False  # deflate made it bigger
+        return block_data, compressed
+
+    return map_blocks(compress_block, blocks, workers)
+
+
+def write_kt_gz(out_stream: BinaryIO, blocks, total_size):
+    """Writes the header and the (data, compressed) blocks in order, returns the size written."""
+    # include the 4-byte size in block header
+    block_sizes = [len(block_data) + 4 if compressed else len(block_data) for block_data, compressed in blocks]
+
+    out_stream.write(KT_GZ_HEADER_STRUCT.pack(KT_GZ_BLOCK_SIZE, len(blocks), total_size))
+    out_stream.write(struct.pack(f"<{len(blocks)}I", *block_sizes))
+    current_offset = KT_GZ_HEADER_STRUCT.size + len(blocks) * 4
+    for (block_data, compressed), block_size in zip(blocks, block_sizes):
+        out_stream.write(b'\x00' * (align_0x80(current_offset) - current_offset))
+        if compressed:
+            out_stream.write(struct.pack("<I", len(block_data)))
+        out_stream.write(block_data)
+        current_offset = align_0x80(current_offset) + block_size
+
+    # pad 0 after the last block
+    out_stream.write(b'\x00' * (align_0x80(current_offset) - current_offset))
+    return align_0x80(current_offset)
+
+
+def compress_kt_gz(in_stream: BinaryIO, out_stream: BinaryIO, total_size, level=-1, workers=None, reference: BinaryIO = None,
+                   strategy=None, raw_tail=False):
+    """
+    Compresses total_size bytes of in_stream into out_stream. If reference is given (a stream positioned at
+    an older version of the same KT-gz file, or what read_reference_blocks returned for it), blocks whose
+    data didn't change are copied from it as they are, only the changed ones get compressed again.
+    strategy and raw_tail are passed on to compress_blocks.
+    """
+    base_offset = out_stream.tell()
+    block_count = block_count_for(total_size)
+    current_offset = align_0x80(KT_GZ_HEADER_STRUCT.size + block_count * 4)
+    block_sizes = bytearray()
+    if reference is not None and not isinstance(reference, dict):
+        reference = read_reference_blocks(reference, workers)
+
+    in_blocks = ((in_stream.read(min(KT_GZ_BLOCK_SIZE, total_size - KT_GZ_BLOCK_SIZE * block_index)), block_index == block_count - 1)
+                 for block_index in range(block_count))
+    workers = min(workers or os.cpu_count() or 1, block_count)
+    # The header is written last, everything after it is written in order, padding included,
+    # so the output has its full size even if the last block is an empty uncompressed one
+    end_offset = KT_GZ_HEADER_STRUCT.size + block_count * 4
+    out_stream.seek(base_offset + end_offset)
+    for block_data, compressed in compress_blocks(in_blocks, level, workers, reference, strategy, raw_tail):
+        block_size = len(block_data)
+
+        out_stream.write(b'\x00' * (current_offset - end_offset))
+        if compressed:
+            out_stream.write(struct.pack("<I", block_size))
+            block_size += 4  # include the 4-byte size in block header
+        out_stream.write(block_data)
+
+        block_sizes.extend(struct.pack("<I", block_size))
+        end_offset = current_offset + block_size
+        current_offset = align_0x80(end_offset)
+
+    # pad 0 after the last block
+    out_stream.write(b'\x00' * (current_offset - end_offset))
+
+    # write header
+    out_stream.seek(base_offset)
+    out_stream.write(KT_GZ_HEADER_STRUCT.pack(KT_GZ_BLOCK_SIZE, block_count, total_size))
+    out_stream.write(block_sizes)
+
+    out_stream.seek(base_offset + current_offset)
+    return current_offset
+
+
+def compress_kt_gz_stream(chunks, out_stream: BinaryIO, level=-1, workers=None, reference=None, strategy=None,
+                          raw_tail=False):
+    """
+    Compresses the data in chunks (any iterable of bytes) into out_stream, which is only written to in order,
+    so it can be a pipe. The header needs every block size, so only the compressed blocks are kept until the
+    input ends, the uncompressed data never is as a whole. The other arguments are the same as for compress_kt_gz.
+    """
+    if reference is not None and not isinstance(reference, dict):
+        reference = read_reference_blocks(reference, workers)
+
+    total_size = 0
+
+    def counted(blocks):
+        nonlocal total_size
+        for data, is_last in blocks:
+            total_size += len(data)
+            yield data, is_last
+
+    blocks = list(compress_blocks(counted(split_blocks(chunks)), level, workers, reference, strategy, raw_tail))
+    return write_kt_gz(out_stream, blocks, total_size)
+
+
+def compress_kt_gz_buffer(data, level=-1, workers=None, reference=None, strategy=None, raw_tail=False):
+    """Compresses bytes-like data and returns the whole KT-gz file."""
+    data = memoryview(data).cast('B')
+    block_count = block_count_for(len(data))
+    in_blocks = ((data[block_index * KT_GZ_BLOCK_SIZE:(block_index + 1) * KT_GZ_BLOCK_SIZE], block_index == block_count - 1)
+                 for block_index in range(block_count))
+    if reference is not None and not isinstance(reference, dict):
+        reference = read_reference_blocks(reference, workers)
+    blocks = list(compress_blocks(in_blocks, level, min(workers or os.cpu_count() or 1, block_count), reference, strategy,
+                                  raw_tail))
+    out_stream = io.BytesIO()
+    write_kt_gz(out_stream, blocks, len(data))
+    return out_stream.getvalue()
+
+
+class KtGzHeader:
+    """
+    The block layout of a KT-gz file, worked out from its header alone. Block offsets are relative to
+    the start of the header and point at the deflate data, past the 4-byte size in front of it.
+    """
+
+    def __init__(self, block_size, total_size, block_offsets, block_data_sizes, last_block_compressed, end_offset):
+        self.block_size = block_size
+        self.total_size = total_size
+        self.block_offsets = block_offsets
+        self.block_data_sizes = block_data_sizes
+        self.last_block_compressed = last_block_compressed
+        self.end_offset = end_offset
+
+    def __len__(self):
+        return len(self.block_offsets)
+
+    def is_compressed(self, block_index):
+        return block_index != len(self) - 1 or self.last_block_compressed
+
+    def out_size(self, block_index):
+        """Returns the decompressed size of a block."""
+        return min(self.block_size, self.total_size - self.block_size * block_index)
+
+    def block_range(self, start, size):
+        """Returns the range of the blocks that cover size bytes from start of the decompressed data."""
+        end = min(start + size, self.total_size)
+        if start >= end:
+            return range(0)
+        return range(start // self.block_size, (end - 1) // self.block_size + 1)
+
+
+def parse_kt_gz_header(data):
+    """Returns the KtGzHeader of the KT-gz file at the start of data (at least its header and block table)."""
+    if len(data) < KT_GZ_HEADER_STRUCT.size:
+        raise KtGzError(f"Header is truncated ({len(data)} bytes)")
+    block_size, block_count, total_size = KT_GZ_HEADER_STRUCT.unpack_from(data)
+    if block_size == -1:  # block has no size header
+        raise NotImplementedError  # doesn't exist in Three Houses
+    if block_size <= 0:
+        raise KtGzError(f"Invalid block size {block_size}")
+    if block_count != (total_size + block_size - 1) // block_size and not (block_count == 1 and total_size == 0):
+        raise KtGzError(f"{block_count} blocks of {block_size} bytes don't add up to {total_size} bytes")
+    if len(data) < KT_GZ_HEADER_STRUCT.size + block_count * 4:
+        raise KtGzError(f"Block table of {block_count} blocks is truncated")
+    block_sizes = struct.unpack_from(f"<{block_count}I", data, KT_GZ_HEADER_STRUCT.size)
+    current_offset = align_0x80(KT_GZ_HEADER_STRUCT.size + block_count * 4)
+
+    # For some reason last block can be not compressed. I have no idea how KT determines when to do this
+    # Seems to happen randomly when the size is small (kt_gz.py scan tallies it). Only way is to check
+    last_block_compressed = not block_sizes or block_sizes[-1] != total_size - block_size * (block_count - 1)
+
+    block_offsets = []
+    block_data_sizes = []
+    for block_index, cur_block_size in enumerate(block_sizes):
+        if block_index != block_count - 1 or last_block_compressed:
+            # the size in the header includes the 4-byte size in block header
+            if cur_block_size < 4:
+                raise KtGzError(f"Block {block_index} is too small ({cur_block_size} bytes)")
+            block_offsets.append(current_offset + 4)
+            block_data_sizes.append(cur_block_size - 4)
+        else:
+            block_offsets.append(current_offset)
+            block_data_sizes.append(cur_block_size)
+        current_offset = align_0x80(current_offset + cur_block_size)
+
+    return KtGzHeader(block_size, total_size, block_offsets, block_data_sizes, last_block_compressed, current_offset)
+
+
+def read_kt_gz_header(in_stream: BinaryIO):
+    """Reads the header at the current position of in_stream and returns its KtGzHeader."""
+    header = in_stream.read(KT_GZ_HEADER_STRUCT.size)
+    if len(header) == KT_GZ_HEADER_STRUCT.size:
+        block_count = KT_GZ_HEADER_STRUCT.unpack(header)[1]
+        header += in_stream.read(block_count * 4)
+    return parse_kt_gz_header(header)
+
+
+def decompress_block(header: KtGzHeader, block_index, stored):
+    """Returns the decompressed data of a block from its stored data."""
+    size = header.out_size(block_index)
+    try:
+        if header.is_compressed(block_index):
+            data = codec.decompress(stored, size)
+        else:
+            data = bytes(stored)  # not compressed
+            # Earlier versions of kt_gz.py could write a compressed last block whose size matches the
+            # uncompressed size exactly, which then looks like an uncompressed one
+            if size >= 4 and data[:4] == struct.pack("<I", size - 4):
+                try:
+                    inflated = codec.decompress(stored[4:], size)
+                    if len(inflated) == size:
+                        data = inflated
+                except codec.error:
+                    pass
+    except codec.error as ex:
+        raise KtGzError(f"Block {block_index} can't be decompressed ({ex})") from ex
+    if len(data) != size:
+        raise KtGzError(f"Block {block_index} decompresses to {len(data)} bytes instead of {size}")
+    return data
+
+
+def read_stored_blocks(in_stream: BinaryIO, base_offset, header: KtGzHeader, block_indices):
+    """Yields the stored (still compressed) data and the index of the given blocks."""
+    for block_index in block_indices:
+        in_stream.seek(base_offset + header.block_offsets[block_index])
+        stored = in_stream.read(header.block_data_sizes[block_index])
+        if len(stored) != header.block_data_sizes[block_index]:
+            raise KtGzError(f"Block {block_index} is truncated")
+        yield stored, block_index
+
+
+def buffer_stored_blocks(data, header: KtGzHeader, block_indices):
+    """Like read_stored_blocks, for a KT-gz file in a bytes-like object, the blocks are views into it."""
+    data = memoryview(data).cast('B')
+    for block_index in block_indices:
+        start = header.block_offsets[block_index]
+        end = start + header.block_data_sizes[block_index]
+        if end > len(data):
+            raise KtGzError(f"Block {block_index} ends at 0x{end:X}, past the end of the data (0x{len(data):X})")
+        yield data[start:end], block_index
+
+
+def decompress_blocks(header: KtGzHeader, stored_blocks, workers=None):
+    """Yields the decompressed data of the (stored, block_index) blocks in order, inflating up to workers of them at once."""
+    # Reading stays on this thread, in order, only the inflating is spread over the workers
+    return map_blocks(lambda stored, block_index: decompress_block(header, block_index, stored), stored_blocks,
+                      min(workers or os.cpu_count() or 1, len(header)))
+
+
+def read_kt_gz_blocks(in_stream: BinaryIO, base_offset, header: KtGzHeader, block_indices, workers=None):
+    """Yields the decompressed data of the given blocks in order, inflating up to workers of them at once."""
+    return decompress_blocks(header, read_stored_blocks(in_stream, base_offset, header, block_indices), workers)
+
+
+class ReferenceBlocks(dict):
+    """
+    The blocks of an older version of a KT-gz file, for compress_kt_gz to reuse: maps the sha1 of the decompressed
+    data of every block to its stored (data, compressed). Also tells whether its last block was compressed.
+    """
+
+    def __init__(self, blocks=(), last_block_compressed=True):
+        super().__init__(blocks)
+        self.last_block_compressed = last_block_compressed
+
+
+def read_reference_blocks(in_stream: BinaryIO, workers=None):
+    """Returns the ReferenceBlocks of the KT-gz file at the current position of in_stream."""
+    base_offset = in_stream.tell()
+    header = read_kt_gz_header(in_stream)
+
+    def hash_block(stored, block_index):
+        digest = hashlib.sha1(decompress_block(header, block_index, stored)).digest()
+        return digest, (stored, header.is_compressed(block_index))
+
+    return ReferenceBlocks(map_blocks(hash_block, read_stored_blocks(in_stream, base_offset, header, range(len(header))),
+                                      min(workers or os.cpu_count() or 1, len(header))),
+                           header.last_block_compressed)
+
+
+def decompress_kt_gz(in_stream: BinaryIO, out_stream: BinaryIO, workers=None):
+    base_offset = in_stream.tell()
+    header = read_kt_gz_header(in_stream)
+    for block_data in read_kt_gz_blocks(in_stream, base_offset, header, range(len(header)), workers):
+        out_stream.write(block_data)
+    return header.end_offset
+
+
+def iter_kt_gz_buffer(data, workers=None):
+    """Yields the decompressed blocks of the KT-gz file in a bytes-like object (e.g. a view into a mapped archive)."""
+    header = parse_kt_gz_header(data)
+    return decompress_blocks(header, buffer_stored_blocks(data, header, range(len(header))), workers)
+
+
+def decompress_kt_gz_buffer(data, workers=None):
+    """Decompresses the KT-gz file in a bytes-like object into one preallocated bytearray."""
+    header = parse_kt_gz_header(data)
+    out_data = bytearray(header.total_size)
+    pos = 0
+    for block_data in decompress_blocks(header, buffer_stored_blocks(data, header, range(len(header))), workers):
+        out_data[pos:pos + len(block_data)] = block_data
+        pos += len(block_data)
+    return out_data
+
+
+def read_kt_gz_range(in_stream: BinaryIO, start, size, workers=None):
+    """
+    Returns size bytes from start of the decompressed data of the KT-gz file at the current position
+    of in_stream (fewer at the end of it). Only the blocks covering that range are inflated, so e.g.
+    a G1T or BIN header can be read without decompressing the whole file.
+    """
+    base_offset = in_stream.tell()
+    header = read_kt_gz_header(in_stream)
+    blocks = header.block_range(start, size)
+    if not blocks:
+        return b''
+    data = b''.join(read_kt_gz_blocks(in_stream, base_offset, header, blocks, workers))
+    skip = start - blocks.start * header.block_size
+    return data[skip:skip + size]
+
+
+def is_kt_gz(in_stream: BinaryIO):
+    """Checks whether a KT-gz header is at the current position of in_stream, the position is kept."""
+    base_offset = in_stream.tell()
+    header = in_stream.read(KT_GZ_HEADER_STRUCT.size)
+    in_stream.seek(base_offset)
+    if len(header) < KT_GZ_HEADER_STRUCT.size:
+        return False
+    block_size, block_count, total_size = KT_GZ_HEADER_STRUCT.unpack(header)
+    return block_size == KT_GZ_BLOCK_SIZE and block_count == block_count_for(total_size)
+
+
+class KtGzFile(io.RawIOBase):
+    """
+    Read-only, seekable file over the decompressed data of a KT-gz file. Blocks are only inflated
+    when they are read, and the last few of them are kept, so headers and tables inside can be
+    parsed in place without decompressing everything first.
+
+        with KtGzFile('MC002_EdelgardA_0_P_Body.bin.gz') as f:
+            entry_count = struct.unpack('<I', f.read(4))[0]
+
+    file can be a path, a bytes-like object with the compressed data (read in place, e.g. a view into
+    a mapped archive), or a binary stream positioned at the KT-gz header (which is left open).
+    """
+
+    def __init__(self, file, cache_blocks=8):
+        self._owned_stream = None
+        self._stream = None
+        self._data = None
+        if isinstance(file, (str, os.PathLike)):
+            file = self._owned_stream = open(file, 'rb')
+        try:
+            if isinstance(file, (bytes, bytearray, memoryview)):
+                self._data = memoryview(file).cast('B')
+                self._header = parse_kt_gz_header(self._data)
+            else:
+                self._stream = file
+                self._base_offset = file.tell()
+                self._header = read_kt_gz_header(file)
+        except BaseException:
+            if self._owned_stream:
+                self._owned_stream.close()
+            raise
+        self._pos = 0
+        self._cache = collections.OrderedDict()
+        self._cache_blocks = max(1, cache_blocks)
+
+    @property
+    def size(self):
+        """The decompressed size."""
+        return self._header.total_size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._header.total_size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def _block(self, block_index):
+        # least recently used blocks are dropped first
+        block = self._cache.get(block_index)
+        if block is not None:
+            self._cache.move_to_end(block_index)
+            return block
+        if self._data is not None:
+            stored_blocks = buffer_stored_blocks(self._data, self._header, [block_index])
+        else:
+            stored_blocks = read_stored_blocks(self._stream, self._base_offset, self._header, [block_index])
+        block = decompress_block(self._header, block_index, next(stored_blocks)[0])
+        self._cache[block_index] = block
+        if len(self._cache) > self._cache_blocks:
+            self._cache.popitem(last=False)
+        return block
+
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        buffer = memoryview(buffer).cast('B')
+        size = min(len(buffer), max(0, self._header.total_size - self._pos))
+        done = 0
+        while done < size:
+            block_index, block_pos = divmod(self._pos, self._header.block_size)
+            block = self._block(block_index)
+            count = min(size - done, len(block) - block_pos)
+            buffer[done:done + count] = block[block_pos:block_pos + count]
+            done += count
+            self._pos += count
+        return done
+
+    def close(self):
+        # Drop the view of the data too, so a mapped archive it came from can be closed afterwards
+        self._cache.clear()
+        self._data = None
+        if self._owned_stream:
+            self._owned_stream.close()
+        super().close()
+
+
+def compress_kt_gz_file(in_path, out_path, level=-1, workers=None, reference_path=None, strategy=None, raw_tail=False):
+    reference = None
+    if reference_path:
+        # read before out_path is opened, so the reference can be the file being replaced
+        with open(reference_path, 'rb') as reference_file:
+            reference = read_reference_blocks(reference_file, workers)
+    with open(in_path, 'rb') as in_file, open(out_path, 'wb') as out_file:
+        compress_kt_gz(in_file, out_file, os.path.getsize(in_path), level, workers, reference, strategy, raw_tail)
+
+
+def decompress_kt_gz_file(in_path, out_path, workers=None):
+    with open(in_path, 'rb') as in_file, open(out_path, 'wb') as out_file:
+        decompress_kt_gz(in_file, out_file, workers)
@@ -0,0 +1,73 @@
+from . import kt_gz
+from .kt_gz import KT_GZ_BLOCK_SIZE, buffer_stored_blocks, decompress_block, parse_kt_gz_header
+
+# Upper bounds of the last block sizes the scan groups the files by
+TAIL_SIZE_BUCKETS = (0x10, 0x40, 0x100, 0x400, 0x1000, 0x4000, KT_GZ_BLOCK_SIZE)
+
+
+def inspect_tail(data, level=9):
+    """
+    Returns (size, block count, compressed, deflated size) of the last block of the KT-gz file in the bytes-like
+    data, or None if it has no blocks. The deflated size includes the 4-byte size in front of the deflate data:
+    as stored for a compressed block, what deflating it at level gives for an uncompressed one.
+    """
+    header = parse_kt_gz_header(data)
+    if not len(header):
+        return None
+    last = len(header) - 1
+    size = header.out_size(last)
+    if header.is_compressed(last):
+        return size, len(header), True, header.block_data_sizes[last] + 4
+    stored = next(buffer_stored_blocks(data, header, [last]))[0]
+    deflated = kt_gz.get_codec().compress(decompress_block(header, last, stored), level)
+    return size, len(header), False, len(deflated) + 4
+
+
+class TailStats:
+    """Tallies the inspect_tail results of many KT-gz files, to work out when KT leaves the last block uncompressed."""
+
+    def __init__(self):
+        self.files = 0
+        # per bucket: uncompressed, compressed, uncompressed that deflate would shrink, compressed that it didn't shrink
+        self.buckets = {bucket: [0, 0, 0, 0] for bucket in TAIL_SIZE_BUCKETS}
+        self.single_block = [0, 0]  # uncompressed, compressed last blocks of the files with only one block
+        self.largest_raw = None
+        self.smallest_compressed = None
+
+    def add(self, tail):
+        size, block_count, compressed, deflated_size = tail
+        self.files += 1
+        counts = self.buckets[next(bucket for bucket in TAIL_SIZE_BUCKETS if size <= bucket)]
+        counts[1 if compressed else 0] += 1
+        if compressed and deflated_size >= size:
+            counts[3] += 1
+        elif not compressed and deflated_size < size:
+            counts[2] += 1
+        if block_count == 1:
+            self.single_block[1 if compressed else 0] += 1
+        if compressed:
+            if self.smallest_compressed is None or size < self.smallest_compressed:
+                self.smallest_compressed = size
+        elif self.largest_raw is None or size > self.largest_raw:
+            self.largest_raw = size
+
+    @property
+    def raw(self):
+        return sum(counts[0] for counts in self.buckets.values())
+
+
+def format_tail_stats(stats: TailStats):
+    """Returns the report lines of a TailStats."""
+    share = stats.raw / stats.files * 100 if stats.files else 0
+    lines = [f"Scanned {stats.files} files, {stats.raw} ({share:.1f}%) have an uncompressed last block",
+             f"{'Last block size':<16} {'raw':>8} {'compressed':>11} {'raw, deflate shrinks it':>24} {'compressed, not shrunk':>23}"]
+    for bucket, (raw, compressed, shrinkable, grown) in stats.buckets.items():
+        if raw or compressed:
+            label = f"<= {bucket}" if bucket < 0x400 else f"<= {bucket // 0x400} KiB"
+            lines.append(f"{label:<16} {raw:>8} {compressed:>11} {shrinkable:>24} {grown:>23}")
+    lines.append(f"Files with one block: {stats.single_block[0]} raw, {stats.single_block[1]} compressed last blocks")
+    if stats.largest_raw is not None:
+        lines.append(f"Largest uncompressed last block: {stats.largest_raw} bytes")
+    if stats.smallest_compressed is not None:
+        lines.append(f"Smallest compressed last block: {stats.smallest_compressed} bytes")
+    return lines
@@ -0,0 +1,110 @@
+import argparse
+import os
+import time
+
+from . import kt_gz
+from .kt_gz import KT_GZ_BLOCK_SIZE, KT_GZ_HEADER_STRUCT, align_0x80, block_count_for
+
+AUTO_LEVEL = "auto"
+AUTO_SAMPLE_BLOCKS = 12
+# Without an original size to stay under, the budget is the size level 9 would give plus this much
+AUTO_SIZE_TOLERANCE = 0.01
+
+
+def parse_level(text):
+    """argparse type for compression levels: a number, or "auto" to let tune_compression choose one."""
+    if text == AUTO_LEVEL:
+        return AUTO_LEVEL
+    try:
+        return int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid compression level {text}, use a number or {AUTO_LEVEL}") from None
+
+
+class CompressionTrial:
+    """How one level and strategy did on the sample blocks, scaled up to the whole input."""
+
+    def __init__(self, level, strategy, sample_size, compressed_size, seconds, total_size):
+        self.level = level
+        self.strategy = strategy
+        self.seconds = seconds
+        # Every block also takes its 4-byte size, its block table entry and its padding to 0x80 (about 0x40)
+        block_count = block_count_for(total_size)
+        ratio = compressed_size / sample_size if sample_size else 1
+        self.estimated_size = (int(total_size * ratio) + block_count * (8 + 0x40)
+                               + align_0x80(KT_GZ_HEADER_STRUCT.size + block_count * 4))
+        self.speed = sample_size / seconds if seconds else float("inf")  # bytes per second
+
+    @property
+    def name(self):
+        return f"level {self.level}" if self.strategy is None else f"level {self.level} {self.strategy}"
+
+
+def sample_blocks(paths, count=AUTO_SAMPLE_BLOCKS):
+    """
+    Reads up to count blocks from evenly spaced places of the given files, as if they were one input.
+    Returns the blocks and the total size of the files.
+    """
+    sizes = [os.path.getsize(path) for path in paths]
+    total_size = sum(sizes)
+    block_total = sum(block_count_for(size) for size in sizes if size)
+    step = max(1, block_total // count)
+    samples = []
+    block_number = 0
+    for path, size in zip(paths, sizes):
+        if not size:
+            continue
+        with open(path, 'rb') as f:
+            for block_index in range(block_count_for(size)):
+                if block_number % step == 0 and len(samples) < count:
+                    f.seek(block_index * KT_GZ_BLOCK_SIZE)
+                    samples.append(f.read(KT_GZ_BLOCK_SIZE))
+                block_number += 1
+    return samples, total_size
+
+
+def tune_compression(samples, total_size, budget=None, codec=None):
+    """
+    Compresses the sample blocks with every level and strategy of the codec (the current one by default).
+    Returns the fastest trial whose estimated size for total_size bytes of input stays within budget, all
+    the trials and the budget. Without a budget, the size of level 9 (plus AUTO_SIZE_TOLERANCE) is used.
+    If nothing fits, the smallest setting is chosen.
+    """
+    codec = codec or kt_gz.get_codec()
+    sample_size = sum(len(sample) for sample in samples)
+    trials = []
+    for strategy in (None, *codec.strategies):
+        for level in codec.levels:
+            start = time.perf_counter()
+            compressed_size = sum(len(codec.compress(sample, level, strategy)) for sample in samples)
+            trials.append(CompressionTrial(level, strategy, sample_size, compressed_size,
+                                           time.perf_counter() - start, total_size))
+
+    if budget is None:
+        level_9 = next((trial for trial in trials if trial.level == 9 and trial.strategy is None), None)
+        reference_size = level_9.estimated_size if level_9 else min(trial.estimated_size for trial in trials)
+        budget = int(reference_size * (1 + AUTO_SIZE_TOLERANCE))
+    fitting = [trial for trial in trials if trial.estimated_size <= budget]
+    if fitting:
+        best = min(fitting, key=lambda trial: trial.seconds)
+    else:
+        best = min(trials, key=lambda trial: (trial.estimated_size, trial.seconds))
+    return best, trials, budget
+
+
+def format_trials(best, trials, budget):
+    """
+    Returns the report lines of tune_compression: the trials that no other one beats in both size and
+    speed, from the fastest one.
+    """
+    lines = [f"Size budget: {budget} bytes"]
+    for trial in sorted(trials, key=lambda trial: trial.seconds):
+        dominated = any(other.seconds <= trial.seconds and other.estimated_size <= trial.estimated_size
+                        and (other.seconds, other.estimated_size) != (trial.seconds, trial.estimated_size)
+                        for other in trials)
+        if dominated and trial is not best:
+            continue
+        marker = "*" if trial is best else " "
+        fits = "" if trial.estimated_size <= budget else " (over budget)"
+        lines.append(f"{marker} {trial.name:<16} ~{trial.estimated_size} bytes, {trial.speed / 0x100000:.1f} MiB/s{fits}")
+    return lines
@@ -1,119 +1,223 @@
+import concurrent.futures
+import glob
 import os
-import struct
-import zlib
-from typing import BinaryIO
-
-KT_GZ_BLOCK_SIZE = 0x10000
-KT_GZ_HEADER_STRUCT = struct.Struct("<iII")
-KT_GZ_EXTENSION = ".gz"
-
-
-def align_0x80(offset):
-    return (offset + 0x7F) & ~0x7F
-
-
-def compress_kt_gz(in_stream: BinaryIO, out_stream: BinaryIO, total_size, level=-1):
-    base_offset = out_stream.tell()
-    block_count = (total_size - 1) // KT_GZ_BLOCK_SIZE + 1
-    current_offset = align_0x80(KT_GZ_HEADER_STRUCT.size + block_count * 4)
-    block_sizes = bytearray()
-
-    def write_block(in_block_size):
-        compressed_block_data = zlib.compress(in_stream.read(in_block_size), level)
-        block_size = len(compressed_block_data)
-
-        out_stream.seek(base_offset + current_offset)
-        out_stream.write(struct.pack("<I", block_size))
-        out_stream.write(compressed_block_data)
-
-        block_size += 4  # include the 4-byte size in block header
-        block_sizes.extend(struct.pack("<I", block_size))
-        return align_0x80(current_offset + block_size)
-
-    for _ in range(block_count - 1):
-        current_offset = write_block(KT_GZ_BLOCK_SIZE)
-
-    # last block and pad 0
-    current_offset = write_block(total_size - KT_GZ_BLOCK_SIZE * (block_count - 1))
-    out_stream.write(b'\x00' * (current_offset - (out_stream.tell() - base_offset)))
-
-    # write header
-    out_stream.seek(base_offset)
-    out_stream.write(KT_GZ_HEADER_STRUCT.pack(KT_GZ_BLOCK_SIZE, block_count, total_size))
-    out_stream.write(block_sizes)
-
-    out_stream.seek(base_offset + current_offset)
-    return current_offset
-
-
-def decompress_kt_gz(in_stream: BinaryIO, out_stream: BinaryIO):
-    base_offset = in_stream.tell()
-
-    # read header
-    block_size, block_count, total_size = KT_GZ_HEADER_STRUCT.unpack(in_stream.read(KT_GZ_HEADER_STRUCT.size))
-    if block_size == -1:  # block has no size header
-        raise NotImplementedError  # doesn't exist in Three Houses
-    block_sizes = [struct.unpack('<I', in_stream.read(4))[0] for _ in range(block_count)]
-    current_offset = align_0x80(KT_GZ_HEADER_STRUCT.size + block_count * 4)
-
-    # deflate blocks
-    def write_block():
-        in_stream.seek(base_offset + current_offset)
-        cur_block_data_size = struct.unpack('<I', in_stream.read(4))[0]
-        out_stream.write(zlib.decompress(in_stream.read(cur_block_data_size)))
-        return align_0x80(current_offset + cur_block_size)
-
-    for cur_block_size in block_sizes[:-1]:
-        current_offset = write_block()
-
-    # For some reason last block can be not compressed. I have no idea how KT determines when to do this
-    # Seems to happen randomly when the size is small. Only way is to check
-    last_block_size = block_sizes[block_count - 1]
-    if last_block_size == total_size - block_size * (block_count - 1):
-        in_stream.seek(base_offset + current_offset)
-        out_stream.write(in_stream.read(last_block_size))  # not compressed
-        current_offset += align_0x80(last_block_size)
-    else:
-        current_offset = write_block()
-
-    return current_offset
-
-
-def compress_kt_gz_file(in_path, out_path, level=-1):
-    with open(in_path, 'rb') as in_file, open(out_path, 'wb') as out_file:
-        compress_kt_gz(in_file, out_file, os.path.getsize(in_path), level)
-
-
-
-def decompress_kt_gz_file(in_path, out_path):
-    with open(in_path, 'rb') as in_file, open(out_path, 'wb') as out_file:
-        decompress_kt_gz(in_file, out_file)
+import time
+
+# The KT-gz code itself lives in the kt_codec package, this keeps "import kt_gz" working and has the command line
+from kt_codec import *
+
+
+def is_kt_gz_path(path):
+    try:
+        with open(path, "rb") as f:
+            return is_kt_gz(f)
+    except OSError:
+        return False
+
+
+def expand_inputs(items, wanted=lambda path: True):
+    """
+    Yields (path, relative path) of every file the items name: files, directories (searched through), globs
+    and @listfiles with one item per line. The relative path is the one under the directory or the fixed part
+    of the glob it was found in. Files found in directories and globs are only kept if wanted(path) says so.
+    """
+    seen = set()
+    for item in items:
+        if item.startswith("@"):
+            with open(item[1:], encoding="utf-8") as f:
+                lines = [line.strip() for line in f]
+            found = expand_inputs([line for line in lines if line and not line.startswith("#")], wanted)
+        elif os.path.isdir(item):
+            found = ((path, os.path.relpath(path, item)) for path in walk_files(item) if wanted(path))
+        elif any(char in item for char in "*?["):
+            root = item
+            while any(char in root for char in "*?["):
+                root = os.path.dirname(root)
+            found = ((path, os.path.relpath(path, root or ".")) for match in sorted(glob.glob(item, recursive=True))
+                     for path in (walk_files(match) if os.path.isdir(match) else [match]) if wanted(path))
+        else:
+            found = [(item, os.path.basename(item))]
+        for path, relative in found:
+            if os.path.normpath(path) not in seen:
+                seen.add(os.path.normpath(path))
+                yield path, relative
+
+
+def walk_files(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+
+def output_path_for(path, mode):
+    if mode == "compress":
+        return path + KT_GZ_EXTENSION
+    if path.lower().endswith(KT_GZ_EXTENSION):
+        return path[:-len(KT_GZ_EXTENSION)]
+    return path + ".decompressed"
+
+
+def process_file(mode, in_path, out_path, level=-1, strategy=None, raw_tail=False, workers=None):
+    """(De)compresses one file of run_batch, returns its size and the size of the output."""
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    try:
+        if mode == "compress":
+            compress_kt_gz_file(in_path, out_path, level, workers, strategy=strategy, raw_tail=raw_tail)
+        else:
+            decompress_kt_gz_file(in_path, out_path, workers)
+    except BaseException:
+        # don't leave half-written output behind
+        if os.path.isfile(out_path):
+            os.remove(out_path)
+        raise
+    return os.path.getsize(in_path), os.path.getsize(out_path)
+
+
+def run_batch(mode, files, processes, codec_name, level=-1, strategy=None, raw_tail=False):
+    """
+    (De)compresses every (in_path, out_path) of files, spread over a pool of processes, so Python starts only once
+    per worker instead of once per file. Prints every file and a summary, returns the paths that failed.
+    """
+    start = time.perf_counter()
+    in_total = out_total = done = 0
+    failed = []
+    # The files are already processed side by side, their blocks don't need threads of their own as well
+    workers = 1 if processes > 1 else None
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=set_codec, initargs=(codec_name,)) as executor:
+        futures = {executor.submit(process_file, mode, in_path, out_path, level, strategy, raw_tail, workers): (in_path, out_path)
+                   for in_path, out_path in files}
+        for future in concurrent.futures.as_completed(futures):
+            in_path, out_path = futures[future]
+            try:
+                in_size, out_size = future.result()
+            except Exception as ex:
+                print(f"Failed: {in_path} ({type(ex).__name__}): {ex}")
+                failed.append(in_path)
+                continue
+            print(f"{mode.capitalize()}ed: {in_path} → {out_path}")
+            in_total += in_size
+            out_total += out_size
+            done += 1
+
+    compressed_total, uncompressed_total = (out_total, in_total) if mode == "compress" else (in_total, out_total)
+    ratio = f" (ratio {compressed_total / uncompressed_total * 100:.1f}%)" if uncompressed_total else ""
+    print(f"{mode.capitalize()}ed {done} files in {time.perf_counter() - start:.2f}s: "
+          f"{in_total} → {out_total} bytes{ratio}, {len(failed)} failed")
+    return failed
+
+
+def scan_tails(paths):
+    """
+    Tallies how the last blocks of the KT-gz files at paths (see expand_inputs) are stored, see TailStats.
+    Returns the number of files that couldn't be read.
+    """
+    stats = TailStats()
+    errors = 0
+    for file_path, relative in expand_inputs(paths, is_kt_gz_path):
+        try:
+            with open(file_path, "rb") as f:
+                tail = inspect_tail(f.read())
+        except (OSError, KtGzError, NotImplementedError) as ex:
+            print(f"{file_path}: {type(ex).__name__}: {ex}")
+            errors += 1
+            continue
+        if tail:
+            stats.add(tail)
+    print("\n".join(format_tail_stats(stats)))
+    if errors:
+        print(f"{errors} files couldn't be read")
+    return errors
 
 
 if __name__ == "__main__":
     import argparse
+    import contextlib
+    import sys
 
     parser = argparse.ArgumentParser(description="KT-style GZip Compressor/Decompressor")
-    parser.add_argument("mode", choices=["compress", "decompress"], help="Mode to run: compress or decompress")
-    parser.add_argument("input", help="Input file path")
-    parser.add_argument("-o", "--output", help="Output file path (optional)")
-    parser.add_argument("-l", "--level", type=int, default=9, help="Compression level (0-9, default: 9)")
+    parser.add_argument("mode", choices=["compress", "decompress", "scan"],
+                        help="Mode to run: compress, decompress, or scan to tally how the last blocks of KT-gz files are stored")
+    parser.add_argument("input", nargs="+",
+                        help="Input files, directories, globs (e.g. 'model/*.bin.gz') or @listfiles with one of them per line ('-' to compress from stdin)")
+    parser.add_argument("-o", "--output",
+                        help="Output file path (optional, '-' to compress to stdout), or the output directory for several inputs (default: next to them)")
+    parser.add_argument("-l", "--level", type=parse_level, default=9,
+                        help="Compression level (0-9, default: 9), or auto to pick the fastest level and strategy that stays within the size of --reference (or of level 9)")
+    parser.add_argument("--codec", default=os.environ.get("KT_GZ_CODEC", "auto"), choices=["auto", *CODEC_LOADERS],
+                        help="Deflate implementation (default: auto, the fastest installed one of zlib-ng, libdeflate and zlib)")
+    parser.add_argument("-r", "--reference", help="Older compressed version of the file, its blocks are reused where the data didn't change (compress only)")
+    parser.add_argument("--raw-tail", action="store_true",
+                        help="Store the last block uncompressed when deflate doesn't shrink it, or when it is in --reference (like the game does)")
+    parser.add_argument("-j", "--jobs", type=int, default=0,
+                        help="Number of threads (de)compressing blocks, or of worker processes for several inputs (default: 0, one per CPU core)")
 
     args = parser.parse_args()
-
+    set_codec(args.codec)
+
+    if "-" in args.input and args.mode != "compress":
+        parser.error(f"{args.mode} needs seekable input files, not stdin")
+    if "-" in args.input and len(args.input) > 1:
+        parser.error("stdin can only be compressed on its own, not together with other inputs")
+    if args.mode == "scan":
+        sys.exit(1 if scan_tails(args.input) else 0)
+    if args.level == AUTO_LEVEL and args.input == ["-"]:
+        parser.error("--level auto needs an input file to sample, not stdin")
+
+    # Several inputs, or ones that can name several files, go to a pool of processes
+    batch = len(args.input) > 1 or any(item.startswith("@") or os.path.isdir(item) or any(char in item for char in "*?[")
+                                       for item in args.input)
+    if batch:
+        if args.reference:
+            parser.error("--reference only works with a single input file")
+        if args.output == "-":
+            parser.error("several inputs can't be written to stdout")
+        wanted = (lambda path: not is_kt_gz_path(path)) if args.mode == "compress" else is_kt_gz_path
+        files = [(in_path, output_path_for(os.path.join(args.output, relative) if args.output else in_path, args.mode))
+                 for in_path, relative in expand_inputs(args.input, wanted)]
+        if not files:
+            print("No input files found")
+            sys.exit(1)
+        strategy = None
+        if args.mode == "compress" and args.level == AUTO_LEVEL:
+            samples, total_size = sample_blocks([in_path for in_path, out_path in files])
+            best, trials, budget = tune_compression(samples, total_size)
+            print("\n".join(format_trials(best, trials, budget)))
+            args.level, strategy = best.level, best.strategy
+        processes = min(args.jobs or os.cpu_count() or 1, len(files))
+        failed = run_batch(args.mode, files, processes, args.codec, args.level, strategy, args.raw_tail)
+        sys.exit(1 if failed else 0)
+
+    args.input = args.input[0]
     # Infer output path if not given
     if not args.output:
-        if args.mode == "compress":
-            args.output = args.input + KT_GZ_EXTENSION
-        else:  # decompress
-            if args.input.lower().endswith(KT_GZ_EXTENSION):
-                args.output = args.input[:-len(KT_GZ_EXTENSION)]
-            else:
-                args.output = args.input + ".decompressed"
-
-    if args.mode == "compress":
-        compress_kt_gz_file(args.input, args.output, level=args.level)
+        args.output = "-" if args.input == "-" else output_path_for(args.input, args.mode)
+
+    report = sys.stderr if args.output == "-" else sys.stdout
+    strategy = None
+    if args.mode == "compress" and args.level == AUTO_LEVEL:
+        samples, total_size = sample_blocks([args.input])
+        budget = os.path.getsize(args.reference) if args.reference else None
+        best, trials, budget = tune_compression(samples, total_size, budget)
+        print("\n".join(format_trials(best, trials, budget)), file=report)
+        args.level, strategy = best.level, best.strategy
+
+    if args.mode == "compress" and "-" in (args.input, args.output):
+        with contextlib.ExitStack() as stack:
+            in_file = sys.stdin.buffer if args.input == "-" else stack.enter_context(open(args.input, "rb"))
+            out_file = sys.stdout.buffer if args.output == "-" else stack.enter_context(open(args.output, "wb"))
+            reference = None
+            if args.reference:
+                with open(args.reference, "rb") as reference_file:
+                    reference = read_reference_blocks(reference_file, args.jobs)
+            compress_kt_gz_stream(read_chunks(in_file), out_file, args.level, args.jobs, reference, strategy,
+                                  args.raw_tail)
+            out_file.flush()
+        print(f"Compressed: {args.input} → {args.output}", file=report)
+    elif args.mode == "compress":
+        compress_kt_gz_file(args.input, args.output, level=args.level, workers=args.jobs, reference_path=args.reference,
+                            strategy=strategy, raw_tail=args.raw_tail)
         print(f"Compressed: {args.input} → {args.output}")
     elif args.mode == "decompress":
-        decompress_kt_gz_file(args.input, args.output)
-        print(f"Decompressed: {args.input} → {args.output}")
\ No newline at end of file
+        decompress_kt_gz_file(args.input, args.output, workers=args.jobs)
+        print(f"Decompressed: {args.input} → {args.output}")